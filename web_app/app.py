@@ -1,12 +1,31 @@
-from flask import Flask, render_template_string, request, jsonify, send_file
-import threading
+if __name__ == '__main__':
+    # `python app.py` is `python serve.py`. Hand over before any setup: the server
+    # imports this module as `app`, so running it here too would set up the store twice
+    import serve
+    serve.main()
+    raise SystemExit
 import time
-import pandas as pd
-import matplotlib.pyplot as plt
+_startup_began = time.perf_counter() # Taken before the imports so the startup budget covers them
+from flask import Flask, Response, render_template, request, jsonify, send_file
+import threading
+import functools
+import hashlib
+import hmac
+import json
 import numpy as np
 import os
+import sys
 from datetime import datetime
 import io # Import io for in-memory plot serving
+from state_store import SAMPLE_COLUMNS, open_store
+from assets import REVALIDATE, CachedBody, asset_url, cached_response, send_asset
+import exports
+import runs
+import scoring
+import profiling
+import compare
+# pandas and matplotlib are imported inside save_csv/plot_all: they cost more than the
+# rest of startup combined and are only needed once a test finishes
 
 app = Flask(__name__)
 
@@ -18,518 +37,74 @@ collection_status = {
 # Configuration
 SOFT_HARD_THRESHOLD = 350
 FRESH_ROTTEN_THRESHOLD = 750
-
-# Global variables
-state = "Idle"
-stop_requested = False
-classification_type = "soft_hard"
-current_test_config = {
-    'cycles': 3,
-    'duration': 5, # Duration per segment (e.g., untouch/touch)
-    'threshold': SOFT_HARD_THRESHOLD
-}
-test_data = {
-    'all_data': [],
-    'untouch_data': [],
-    'touch_data': [],
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", "1.0")) # Import-to-ready budget per worker
+MAX_PLOT_POINTS = 2000 # Most time buckets drawn per RX channel in all_data_plot.png
+MAX_HISTORY_POINTS = 10000 # Most buckets /history returns per request
+LONG_POLL_SECONDS = float(os.environ.get("LONG_POLL_SECONDS", "25")) # Longest a ?wait_for_version= request blocks
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") # X-Admin-Token for /admin/* routes; unset disables them
+
+# Test state and sample buffers live in `store` so every worker sees the same test
+# (see state_store.py). This is the status a fresh server starts with.
+IDLE_STATUS = {
+    'state': "Idle",
+    'run_id': None, # Name of the test's directory in the run archive (see runs.py)
+    'stop_requested': False,
+    'classification_type': "soft_hard",
+    'current_test_config': {
+        'cycles': 3,
+        'duration': 5, # Duration per segment (e.g., untouch/touch)
+        'threshold': SOFT_HARD_THRESHOLD
+    },
+    'test_start_time': None,
+    'test_end_time': None,
+    'data_collection_active': False, # Flag to control data reception
+    'current_phase': "IDLE", # "UNTOUCH" or "TOUCH" or "IDLE" - helps segregate incoming data
+    'cycle': 0, # Cycle the incoming data belongs to (1-based, 0 before the first)
     'average_peak_value': 0, # Initialize to a numeric value
     'touch_max_array': [], # Stores max RX value for each touch event/cycle
+    'peak_summary': None, # Robust statistics of touch_max_array, see scoring.py
     'labels': [],
     'finished': False
 }
-test_start_time = None
-data_collection_active = False # Flag to control data reception
-current_phase = "IDLE" # "UNTOUCH" or "TOUCH" or "IDLE" - helps segregate incoming data
-
-# HTML_TEMPLATE (Assuming this is defined elsewhere or in your actual frontend HTML file)
-# For the purpose of providing a complete runnable example, a minimal HTML is included.
-# In a real scenario, this would be a large HTML string or loaded from a file.
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-  <meta charset="UTF-8">
-  <title>Sensor Test Interface | Arduino Nano 33 IoT</title>
-  <script src="https://kit.fontawesome.com/a076d05399.js" crossorigin="anonymous"></script>
-  <style>
-    :root {
-      --bg-light: #f9f9f9;
-      --bg-dark: #121212;
-      --text-light: #002B5B;
-      --text-dark: #f0f0f0;
-      --card-bg-light: #fff;
-      --card-bg-dark: #1e1e1e;
-    }
-
-    body {
-      margin: 0;
-      padding: 0;
-      font-family: 'Segoe UI', sans-serif;
-      background-color: var(--bg-light);
-      color: var(--text-light);
-      transition: background-color 0.3s ease, color 0.3s ease;
-    }
-
-    body.dark {
-      background-color: var(--bg-dark);
-      color: var(--text-dark);
-    }
-
-    .container {
-      max-width: 860px;
-      margin: 40px auto;
-      background: var(--card-bg-light);
-      border-radius: 12px;
-      box-shadow: 0 8px 24px rgba(0, 0, 0, 0.1);
-      padding: 40px;
-      transition: background-color 0.3s ease;
-    }
-
-    body.dark .container {
-      background: var(--card-bg-dark);
-    }
-
-    h2 {
-      text-align: center;
-      margin-bottom: 35px;
-    }
-
-    label {
-      font-weight: 600;
-      display: block;
-      margin-bottom: 8px;
-    }
-
-    input[type="number"], select {
-      width: 100%;
-      padding: 12px;
-      font-size: 1em;
-      border: 1px solid #ccc;
-      border-radius: 8px;
-      margin-bottom: 20px;
-      background-color: inherit;
-      color: inherit;
-    }
-
-    .radio-group {
-      display: flex;
-      justify-content: space-between;
-      flex-wrap: wrap;
-      margin-bottom: 20px;
-    }
-
-    .radio-option {
-      display: flex;
-      align-items: center;
-      gap: 10px;
-      margin: 5px 0;
-    }
-
-    button, a.button {
-      padding: 12px 18px;
-      font-size: 1em;
-      font-weight: 600;
-      color: #fff;
-      background-color: #0077cc;
-      border: none;
-      border-radius: 8px;
-      cursor: pointer;
-      transition: background 0.3s ease, transform 0.2s ease;
-      display: inline-flex;
-      align-items: center;
-      gap: 8px;
-    }
-
-    button:hover, a.button:hover {
-      background-color: #005fa3;
-      transform: scale(1.02);
-    }
-
-    button:disabled {
-      background-color: #888;
-      cursor: not-allowed;
-    }
-
-    .info-box {
-      padding: 14px 18px;
-      margin-top: 20px;
-      border-radius: 6px;
-      font-size: 1em;
-    }
-
-    #status {
-      background-color: #f0f8ff;
-      border-left: 6px solid #17a2b8;
-    }
-
-    #status.running {
-      border-left-color: #ffc107;
-      background-color: #fff8e1;
-    }
-
-    #status.success {
-      border-left-color: #28a745;
-      background-color: #e8f5e9;
-    }
-
-    #status.error {
-      border-left-color: #dc3545;
-      background-color: #f8d7da;
-    }
-
-    #average, #result {
-      background-color: #eaf6ff;
-      border-left: 5px solid #007bff;
-      font-size: 1.1em;
-      font-weight: 600;
-    }
-
-    #timer {
-        background-color: #f0f8ff;
-        border-left: 6px solid #17a2b8;
-        margin-top: 10px;
-    }
-
-    #plotArea {
-      margin-top: 30px;
-    }
-
-    img#plotImg {
-      border: 1px solid #ccc;
-      border-radius: 10px;
-      max-width: 100%;
-      margin-bottom: 15px;
-    }
-
-    .download-buttons {
-      display: flex;
-      gap: 10px;
-      flex-wrap: wrap;
-    }
-
-    a.button {
-      background-color: #28a745;
-      text-decoration: none;
-    }
-
-    a.button:hover {
-      background-color: #218838;
-    }
-
-    .hidden {
-      display: none;
-    }
-
-    .loading {
-      display: inline-block;
-      width: 18px;
-      height: 18px;
-      border: 3px solid #f3f3f3;
-      border-top: 3px solid #007bff;
-      border-radius: 50%;
-      animation: spin 1s linear infinite;
-    }
-    
-    .top-bar {
-      display: flex;
-      justify-content: flex-end;
-      margin-bottom: 10px;
-    }
-
-    .dark-toggle {
-      margin-right: 10px;
-      display: flex;
-      align-items: center;
-      gap: 6px;
-    }
-
-    .dark-toggle input {
-      transform: scale(1.2);
-    }
-
-    @media (max-width: 600px) {
-      .container {
-        padding: 25px;
-      }
-
-      .radio-group {
-        flex-direction: column;
-      }
-
-      button {
-        width: 100%;
-        margin-bottom: 10px;
-      }
-    }
-    body.dark #status,
-    body.dark #average,
-    body.dark #result,
-    body.dark #timer {
-      background-color: #1c2938;
-      color: #d6e9ff;
-      border-left-color: #4dabf7;
-    }
-
-    body.dark #status.success {
-      background-color: #1e3521;
-      border-left-color: #4caf50;
-      color: #d1f0d2;
-    }
-
-    body.dark #status.error {
-      background-color: #3b1d1d;
-      border-left-color: #f44336;
-      color: #f4cccc;
-    }
-
-    body.dark #status.running {
-      background-color: #403914;
-      border-left-color: #ffc107;
-      color: #fff1a3;
-    }
-    body.dark a.button {
-      background-color: #388e3c;
-    }
-
-    body.dark a.button:hover {
-      background-color: #2e7d32;
-    }
-  </style>
-</head>
-<body>
-<div class="container">
-  <div class="top-bar">
-    <div class="dark-toggle">
-      <label for="darkSwitch"><i class="fas fa-moon"></i> Dark Mode</label>
-      <input type="checkbox" id="darkSwitch">
-    </div>
-  </div>
-
-  <h2>Arduino Nano 33 IoT Sensor Test</h2>
-
-  <form id="testForm">
-    <label>Classification Type:</label>
-    <div class="radio-group">
-      <div class="radio-option">
-        <input type="radio" id="soft_hard" name="classification_type" value="soft_hard" checked>
-        <label for="soft_hard">Soft / Hard</label>
-      </div>
-      <div class="radio-option">
-        <input type="radio" id="fresh_rotten" name="classification_type" value="fresh_rotten">
-        <label for="fresh_rotten">Fresh / Rotten</label>
-      </div>
-    </div>
-
-    <label for="cycles">Number of Cycles</label>
-    <input type="number" id="cycles" value="3" min="1">
-    <div id="softHardThresholdGroup">
-      <label for="softThreshold">Soft/Hard Threshold</label>
-      <input type="number" id="softThreshold" value="350" min="0">
-    </div>
-
-    <div id="freshRottenThresholdGroup" class="hidden">
-      <label for="freshThreshold">Fresh/Rotten Threshold</label>
-      <input type="number" id="freshThreshold" value="750" min="0">
-    </div>
-
-      <label for="duration">Duration per Cycle Segment (seconds)</label>
-      <input type="number" id="duration" value="5" min="1">
-
-    <button type="submit" id="startBtn">
-      <i class="fas fa-play"></i> Start Test
-    </button>
-
-    <button type="button" id="stopBtn">
-      <i class="fas fa-stop"></i> Stop Test
-    </button>
-  </form>
-
-  <div id="status" class="info-box">Status: {{ status }}</div>
-  <div id="timer" class="info-box hidden">Elapsed Time: 0s</div>
-  <div id="average" class="info-box hidden"></div>
-  <div id="result" class="info-box hidden"></div>
-
-  <div id="plotArea" class="hidden">
-    <h3>Sensor Data Plot</h3>
-    <img id="plotImg" src="/plot?t={{ timestamp }}" alt="Sensor Plot">
-    <br>
-    <div class="download-buttons">
-      <a href="/download_all" class="button"><i class="fas fa-download"></i> Download All Data CSV</a>
-      <a href="/download_touch" class="button"><i class="fas fa-download"></i> Download Touch Data CSV</a>
-      <a href="/download_untouch" class="button"><i class="fas fa-download"></i> Download Untouch Data CSV</a>
-    </div>
-  </div>
-</div>
-
-<script>
-  const startBtn = document.getElementById("startBtn");
-  const stopBtn = document.getElementById("stopBtn");
-  const statusBox = document.getElementById("status");
-  const timerBox = document.getElementById("timer");
-
-  // Variables for timer offset
-  let timerDisplayOffset = 0;
-  let timerStartedDisplaying = false; // Flag to track when timer first becomes visible
-
-  // Dark mode
-  const darkSwitch = document.getElementById('darkSwitch');
-  if (localStorage.getItem("dark-mode") === "true") {
-    document.body.classList.add('dark');
-    darkSwitch.checked = true;
-  }
-
-  darkSwitch.addEventListener('change', () => {
-    document.body.classList.toggle('dark');
-    localStorage.setItem("dark-mode", darkSwitch.checked);
-  });
-
-  const softGroup = document.getElementById("softHardThresholdGroup");
-  const freshGroup = document.getElementById("freshRottenThresholdGroup");
-  document.querySelectorAll('input[name="classification_type"]').forEach(radio => {
-    radio.addEventListener("change", () => {
-      if (radio.checked && radio.value === "soft_hard") {
-        softGroup.classList.remove("hidden");
-        freshGroup.classList.add("hidden");
-      } else {
-        softGroup.classList.add("hidden");
-        freshGroup.classList.remove("hidden");
-      }
-    });
-  });
-
-
-  document.getElementById("testForm").onsubmit = async function(e) {
-    e.preventDefault();
-    const classificationType = document.querySelector('input[name="classification_type"]:checked').value;
-    const cycles = document.getElementById("cycles").value;
-    const duration = document.getElementById("duration").value;
-    const softThreshold = document.getElementById("softThreshold").value;
-    const freshThreshold = document.getElementById("freshThreshold").value;
-
-    // Reset UI and timer state for a new test
-    statusBox.className = 'info-box running';
-    statusBox.innerText = "Status: Starting test..."; // Initial status during the delay
-    timerBox.classList.add("hidden"); // Hide timer initially
-    timerStartedDisplaying = false; // Reset the flag
-    timerDisplayOffset = 0; // Reset the offset
-    document.getElementById("result").classList.add("hidden");
-    document.getElementById("average").classList.add("hidden");
-    document.getElementById("plotArea").classList.add("hidden");
-
-    // Spinner ON (start button disabled)
-    startBtn.disabled = true;
-
-    const res = await fetch('/start', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        classification_type: classificationType,
-        cycles: cycles,
-        duration: duration,
-        soft_threshold: softThreshold,
-        fresh_threshold: freshThreshold
-      })
-    });
-
-    const data = await res.json();
-    startBtn.disabled = false;
-    // Status text will be updated by updateStatus polling
-  };
-
-
-  stopBtn.onclick = async function() {
-    const confirmStop = confirm("Are you sure you want to stop the test?");
-    if (!confirmStop) return;
-
-    await fetch('/stop');
-    statusBox.className = 'info-box error';
-    statusBox.innerText = "Status: Test stopped by user.";
-    timerBox.classList.add("hidden"); // Hide timer on stop
-    timerBox.innerText = "Elapsed Time: 0s";
-    timerStartedDisplaying = false; // Reset flag
-    timerDisplayOffset = 0; // Reset offset
-  };
-
-  async function updateStatus() {
-    try {
-      const res = await fetch('/status');
-      const data = await res.json();
-
-      if (data.status) {
-        statusBox.innerText = "Status: " + data.status;
-      }
-
-      // **Modified timer update logic**
-      if (data.status.includes("Collecting") || data.status.includes("Cycle")) { // Added "Collecting" for general data collection phase
-        if (!timerStartedDisplaying) {
-            // This is the first time we're seeing a "Collecting" or "Cycle" status
-            // data.elapsed_time will be the time passed since test_start_time was set in backend
-            // We set this as our offset so subsequent counts start from 0
-            timerDisplayOffset = data.elapsed_time;
-            timerStartedDisplaying = true;
-            timerBox.classList.remove("hidden");
-            timerBox.innerText = "Elapsed Time: 0s"; // Display 0 at the start of measurement
-        } else {
-            // For subsequent updates, subtract the initial offset
-            // Ensure the time doesn't go negative due to minor sync issues
-            let displayTime = Math.max(0, data.elapsed_time - timerDisplayOffset);
-            timerBox.innerText = "Elapsed Time: " + displayTime + "s";
-        }
-      } else if (data.finished) {
-            timerBox.classList.remove("hidden");
-            // For total time, display the actual elapsed time from backend (no offset needed for final display)
-            timerBox.innerText = "Total Time: " + data.elapsed_time + "s";
-            // Reset flags for next test cycle
-            timerStartedDisplaying = false;
-            timerDisplayOffset = 0;
-      } else { // Idle, starting, or stopped before a cycle began
-            timerBox.classList.add("hidden");
-            timerBox.innerText = "Elapsed Time: 0s"; // Reset visual for next run
-            timerStartedDisplaying = false; // Reset flag
-            timerDisplayOffset = 0; // Reset offset
-      }
-
-      if (data.finished) {
-        statusBox.className = 'info-box success';
-        const currentType = document.querySelector('input[name="classification_type"]:checked').value;
-
-        if (currentType === "soft_hard" && data.average !== null && data.average !== undefined) {
-          document.getElementById("average").innerText = "Average of Touch Peaks: " + data.average.toFixed(2);
-          document.getElementById("average").classList.remove("hidden");
-        } else {
-          document.getElementById("average").classList.add("hidden");
-        }
-
-        document.getElementById("result").innerText = "Classification: " + data.result;
-        document.getElementById("result").classList.remove("hidden");
-
-        document.getElementById("plotImg").src = "/plot?t=" + new Date().getTime();
-        document.getElementById("plotArea").classList.remove("hidden");
-      }
-    } catch (error) {
-      console.error("Error updating status:", error);
-    }
-
-    setTimeout(updateStatus, 1000);
-  }
-
-  updateStatus();
-</script>
-</body>
-</html>
-'''
+store = open_store(IDLE_STATUS)
+clock = time # time()/sleep() used to pace a test; replay.py swaps in a faster clock
+test_manager_thread = None # Thread running the current test, see run_test_manager()
+stage_timer = profiling.StageTimer() # Wall/CPU time per ingestion and finalization stage, archived with each run
+
+def timed_stage(name):
+    """Decorator charging the function's wall and CPU time to stage `name` of the current run."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer.stage(store.snapshot()['run_id'], name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+index_page = None # Rendered on first request; see index()
 
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE, status=state, timestamp=datetime.now().timestamp())
+    # The page has no per-request content (live values come from /status), so each
+    # worker renders it once and browsers revalidate it with its ETag
+    global index_page
+    if index_page is None:
+        index_page = CachedBody(render_template('index.html', asset_url=asset_url).encode(), "text/html")
+    return cached_response(index_page, REVALIDATE)
+
+@app.route('/assets/<path:name>')
+def static_asset(name):
+    response = send_asset(name)
+    if response is None:
+        return "Asset not found.", 404
+    return response
 
 @app.route('/start', methods=['POST'])
 def start():
-    global current_test_config, stop_requested, state, test_data, classification_type, test_start_time, data_collection_active, current_phase
-
+    global test_manager_thread
     content = request.get_json()
     classification_type = content['classification_type']
-    
+
     # Validate and set thresholds
     try:
         soft_threshold = int(content.get('soft_threshold', SOFT_HARD_THRESHOLD))
@@ -539,61 +114,105 @@ def start():
     except ValueError:
         return jsonify({"message": "Invalid number format for configuration parameters."}), 400
 
-    current_test_config = {
-        'cycles': cycles,
-        'duration': duration,
-        'threshold': soft_threshold if classification_type == 'soft_hard' else fresh_threshold
-    }
-
-    # Reset all test data
-    test_data = {
-        'all_data': [],
-        'untouch_data': [],
-        'touch_data': [],
-        'average_peak_value': 0, # Initialize to a numeric value to avoid NoneType issues
-        'touch_max_array': [],
-        'labels': [],
-        'finished': False
-    }
+    # Reset all test data and allow Arduino to send data, starting with the UNTOUCH phase
+    store.reset(dict(
+        IDLE_STATUS,
+        classification_type=classification_type,
+        current_test_config={
+            'cycles': cycles,
+            'duration': duration,
+            'threshold': soft_threshold if classification_type == 'soft_hard' else fresh_threshold
+        },
+        data_collection_active=True,
+        current_phase="UNTOUCH",
+        state="Starting test: UNTOUCH phase...",
+        run_id=datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3],
+        test_start_time=clock.time()
+    ))
 
-    stop_requested = False
-    data_collection_active = True # Allow Arduino to send data
-    current_phase = "UNTOUCH" # Start with UNTOUCH phase
-    state = "Starting test: UNTOUCH phase..."
-    test_start_time = time.time()
-    
     # Start the test manager in a separate thread
-    thread = threading.Thread(target=run_test_manager)
-    thread.start()
+    test_manager_thread = threading.Thread(target=run_test_manager)
+    test_manager_thread.start()
 
     return jsonify({"message": "Test started..."})
 
 @app.route('/stop')
 def stop():
-    global stop_requested, state, data_collection_active, current_phase
-    stop_requested = True
-    data_collection_active = False # Stop collecting data from Arduino
-    current_phase = "IDLE" # Reset phase
-    state = "Test stopped by user"
-    
+    stop_test("Test stopped by user", "Test Stopped by User")
+    return jsonify({"message": "Stopping..."})
+
+shutdown_lock = threading.Lock() # A second shutdown() waits for the first to finish
+
+def shutdown():
+    """Stop and finalize a test this process is running before it exits (see serve.py)."""
+    with shutdown_lock:
+        thread = test_manager_thread
+        if thread is not None and thread.is_alive():
+            print("Shutting down: finalizing the running test.")
+            stop_test("Test stopped by server shutdown", "Test Stopped by Server Shutdown")
+            thread.join()
+
+def stop_test(state, label):
+    """Stop the current test and, unless it has already finished, process and archive it."""
+    store.update(
+        stop_requested=True,
+        data_collection_active=False, # Stop collecting data from Arduino
+        current_phase="IDLE", # Reset phase
+        state=state
+    )
+
     # If the test was ongoing, ensure final processing
-    if not test_data['finished']:
+    if not store.snapshot()['finished']:
         process_test_results() # Call a general function to process what's collected
         save_csv()
+        save_parquet()
         # Ensure plot_all is called only once after processing
-        plot_all() 
-        # Only append 'Test Stopped by User' if no other classification has occurred
-        if not test_data['labels'] or test_data['labels'][-1] not in ["Hard", "Soft", "Fresh", "Rotten", "Error in Soft/Hard Classification", "Error in Fresh/Rotten Classification"]:
-            test_data['labels'].append("Test Stopped by User")
-        test_data['finished'] = True
-    return jsonify({"message": "Stopping..."})
-  
+        plot_all()
+        # Only append the stop label if no other classification has occurred
+        labels = store.snapshot()['labels']
+        if not labels or labels[-1] not in ["Hard", "Soft", "Fresh", "Rotten", "Error in Soft/Hard Classification", "Error in Fresh/Rotten Classification"]:
+            add_label(label)
+        store.update(finished=True, test_end_time=clock.time())
+        archive_run()
+
+status_bodies = {} # endpoint -> (status version, CachedBody), serialized once per version
+
+def snapshot_response(endpoint, build_body, versioned_etag=True):
+    """Serve build_body(status) for the current status version.
+
+    The JSON is serialized once per version and carries a content ETag, so
+    unchanged polls get a 304. With versioned_etag=False the ETag ignores the
+    version field, so a body whose own fields did not change stays 304 across
+    versions. With ?wait_for_version=N the request blocks until the version
+    differs from N (or LONG_POLL_SECONDS pass) instead of the client polling in
+    a loop.
+    """
+    wait_for_version = request.args.get('wait_for_version', type=int)
+    if wait_for_version is None:
+        status = store.snapshot()
+    else:
+        status = store.wait_for_change(wait_for_version, LONG_POLL_SECONDS)
+
+    cached = status_bodies.get(endpoint)
+    if cached is None or cached[0] != status['version']:
+        fields = build_body(status)
+        etag = None if versioned_etag else hashlib.sha256(json.dumps(fields).encode()).hexdigest()[:16]
+        body = dict(fields, version=status['version'])
+        cached = (status['version'], CachedBody(json.dumps(body).encode(), "application/json", etag))
+        status_bodies[endpoint] = cached
+    return cached_response(cached[1], REVALIDATE)
+
 @app.route('/arduino_status')
 def arduino_status():
-    global data_collection_active, test_start_time, current_test_config
+    # The device only cares about active/duration/start_time, not every status text change
+    return snapshot_response('arduino_status', arduino_status_body, versioned_etag=False)
+
+def arduino_status_body(status):
+    current_test_config = status['current_test_config']
+    test_start_time = status['test_start_time']
 
     # Get duration of one cycle (touch or untouch) in milliseconds
-    duration_per_phase_ms = int(current_test_config.get("duration", 0)) * 1000  
+    duration_per_phase_ms = int(current_test_config.get("duration", 0)) * 1000
 
     # Get number of full touch-untouch cycles
     num_cycles = int(current_test_config.get("cycles", 0))
@@ -604,53 +223,84 @@ def arduino_status():
     # Start time in milliseconds
     start_time_ms = int(test_start_time * 1000) if test_start_time else None
 
-    return jsonify({
-        "active": data_collection_active,
+    return {
+        "active": status['data_collection_active'],
         "duration": total_duration_ms,
         "start_time": start_time_ms
-    })
+    }
 
 
 @app.route('/status')
 def get_status():
-    global test_start_time, state, test_data, classification_type
-    
-    elapsed_time = 0
-    if test_start_time and not test_data['finished']:
-        elapsed_time = time.time() - test_start_time
-    elif test_data['finished'] and test_start_time:
-        elapsed_time = time.time() - test_start_time
-    
+    return snapshot_response('status', status_body)
+
+def status_body(status):
+    # The body only depends on the status document so it can be cached per version:
+    # while a test runs the dashboard counts elapsed time itself, and once it has
+    # finished elapsed_time is the total test time
+    elapsed_time = None
+    if status['finished'] and status['test_start_time'] and status['test_end_time']:
+        elapsed_time = int(status['test_end_time'] - status['test_start_time'])
+
     # Safely get the average value for display
     # Check if it's not None AND if it's relevant for 'soft_hard'
     display_average = None
-    if classification_type == 'soft_hard' and test_data['average_peak_value'] is not None:
-        display_average = round(test_data['average_peak_value'], 2)
+    if status['classification_type'] == 'soft_hard' and status['average_peak_value'] is not None:
+        display_average = round(status['average_peak_value'], 2)
     # If classification_type is not 'soft_hard', display_average remains None, which is fine for fruit_freshness
 
-    return jsonify({
-        "status": state,
-        "finished": test_data['finished'],
-        "result": test_data['labels'][-1] if test_data['labels'] else "No result yet",
+    peak_summary = status['peak_summary']
+    cycle_peaks = None
+    if peak_summary is not None:
+        cycle_peaks = [{"cycle": cycle, "peak": peak, "outlier": outlier} for cycle, peak, outlier
+                       in zip(peak_summary['cycles'], peak_summary['peaks'], peak_summary['outliers'])]
+
+    return {
+        "status": status['state'],
+        "finished": status['finished'],
+        "result": status['labels'][-1] if status['labels'] else "No result yet",
         "average": display_average, # Use the safely determined display_average
-        "classification_type": classification_type,
-        "elapsed_time": int(elapsed_time)
-    })
+        "classification_type": status['classification_type'],
+        "elapsed_time": elapsed_time,
+        "cycle_peaks": cycle_peaks,
+        "median_peak": peak_summary['median'] if peak_summary else None,
+        "confidence": peak_summary['confidence'] if peak_summary else None
+    }
+
 @app.route('/api/post', methods=['POST'])
 def receive_data_from_arduino():
-    global test_data, data_collection_active, current_phase
+    status = store.snapshot()
 
-    if not data_collection_active:
+    if not status['data_collection_active']:
         return jsonify({"message": "Data collection not active."}), 200
 
     try:
-        json_data = request.get_json()
+        with stage_timer.stage(status['run_id'], 'ingest_decode'):
+            json_data = request.get_json()
+        message, code = ingest_packets(json_data, status)
+        return jsonify({"message": message}), code
+
+    except Exception as e:
+        print(f"Error processing batch data: {e}")
+        return jsonify({"message": f"Server error: {str(e)}"}), 500
+
+def ingest_packets(json_data, status=None):
+    """Validate a decoded batch of TX packets and append it to the current test.
 
+    Returns (message, HTTP status). Shared by /api/post and the asyncio
+    ingestion server (ingest_server.py); status is fetched if not given.
+    """
+    if status is None:
+        status = store.snapshot()
+    if not status['data_collection_active']:
+        return "Data collection not active.", 200
+
+    with stage_timer.stage(status['run_id'], 'ingest_parse'):
         if not isinstance(json_data, list):
             print(f"Expected list of TX packets, but got: {type(json_data).__name__}")
-            return jsonify({"message": "Expected a list of TX packets."}), 400
+            return "Expected a list of TX packets.", 400
 
-        valid_count = 0
+        rows = []
         for packet in json_data: # This loop processes each TX scan received in the batch
             if not isinstance(packet, dict):
                 print(f"Skipping non-dict packet: {packet}")
@@ -665,246 +315,269 @@ def receive_data_from_arduino():
                 print(f"Skipping invalid 'rx' data (not a list of 7): {rx_values}")
                 continue
 
-            parsed_data = [packet["time"], packet["tx"]] + rx_values
-            test_data["all_data"].append(parsed_data)
+            rows.append([packet["time"], packet["tx"]] + rx_values)
 
-            if current_phase == "UNTOUCH":
-                test_data["untouch_data"].append(parsed_data)
-            elif current_phase == "TOUCH":
-                test_data["touch_data"].append(parsed_data)
+        if rows:
+            batch = np.array(rows)
+            if batch.dtype.kind not in "iuf":
+                try:
+                    batch = batch.astype(np.float64)
+                except ValueError:
+                    print(f"Rejecting batch with non-numeric values: {rows[0]}")
+                    return "TX packets must contain numeric values.", 400
+            # null (None -> NaN) or overflowing numbers would poison peaks and /status JSON
+            if not np.isfinite(batch).all():
+                print(f"Rejecting batch with null or non-finite values: {rows[0]}")
+                return "TX packets must contain numeric values.", 400
 
-            valid_count += 1
+    if rows:
+        # The whole batch belongs to the phase that was active when it arrived
+        with stage_timer.stage(status['run_id'], 'ingest_store'):
+            store.append_batch(batch, status['current_phase'], status['cycle'], clock.time())
+
+    return f"Received {len(rows)} valid TX packets.", 200
 
-        return jsonify({"message": f"Received {valid_count} valid TX packets."}), 200
 
-    except Exception as e:
-        print(f"Error processing batch data: {e}")
-        return jsonify({"message": f"Server error: {str(e)}"}), 500
 
+def stop_requested():
+    return store.snapshot()['stop_requested']
 
+def add_label(label, **fields):
+    """Append a classification label (and any other status fields) to the current test."""
+    store.append_label(label, **fields)
 
 def run_test_manager():
-    global state, test_data, stop_requested, data_collection_active, test_start_time, current_phase
+    current_test_config = store.snapshot()['current_test_config']
 
     # Calculate total expected duration for all cycles (untouch + touch)
     total_expected_duration = current_test_config['cycles'] * current_test_config['duration'] * 2
 
-    start_time_manager = time.time()
-    
+    start_time_manager = clock.time()
+
     try:
         for cycle_num in range(1, current_test_config['cycles'] + 1):
-            if stop_requested:
+            if stop_requested():
                 break
 
             # --- UNTOUCH Phase ---
-            current_phase = "UNTOUCH"
             state = f"Cycle {cycle_num}/{current_test_config['cycles']}: Collecting UNTOUCH data..."
+            store.update(current_phase="UNTOUCH", cycle=cycle_num, state=state)
             print(state)
-            phase_start_time = time.time()
-            while time.time() - phase_start_time < current_test_config['duration'] and not stop_requested:
-                time.sleep(0.1) # Small sleep to avoid busy-waiting
+            phase_start_time = clock.time()
+            while clock.time() - phase_start_time < current_test_config['duration'] and not stop_requested():
+                clock.sleep(0.1) # Small sleep to avoid busy-waiting
 
-            if stop_requested:
+            if stop_requested():
                 break
-            
+
             # --- TOUCH Phase ---
-            current_phase = "TOUCH"
             state = f"Cycle {cycle_num}/{current_test_config['cycles']}: Collecting TOUCH data..."
+            store.update(current_phase="TOUCH", state=state)
             print(state)
-            phase_start_time = time.time() # Reset phase start time for touch
-            while time.time() - phase_start_time < current_test_config['duration'] and not stop_requested:
-                time.sleep(0.1) # Small sleep to avoid busy-waiting
-        
+            phase_start_time = clock.time() # Reset phase start time for touch
+            while clock.time() - phase_start_time < current_test_config['duration'] and not stop_requested():
+                clock.sleep(0.1) # Small sleep to avoid busy-waiting
+
         # After loop (either completed or stopped)
-        current_phase = "IDLE" # Reset phase control
+        store.update(current_phase="IDLE") # Reset phase control
 
-        if not stop_requested:
-            state = "Processing results..."
-            print(state)
+        if not stop_requested():
+            store.update(state="Processing results...")
+            print("Processing results...")
             process_test_results() # Centralized function for result processing
-            
+
             # Ensure plots and CSVs are saved only once at the end
             save_csv()
-            plot_all() 
-            state = "Test Complete"
+            save_parquet()
+            plot_all()
+            store.update(state="Test Complete")
         else:
             # If stopped manually, processing is handled by /stop route
-            state = "Test Stopped"
+            store.update(state="Test Stopped")
             print("Test Manager: Test was stopped by user.")
 
     except Exception as e:
-        state = f"Test Manager Error: {e}"
+        store.update(state=f"Test Manager Error: {e}")
         print(f"Test Manager Error: {e}")
         import traceback
         traceback.print_exc()
     finally:
-        data_collection_active = False # Ensure data collection stops
-        test_data['finished'] = True # Mark test as finished
+        # Ensure data collection stops and mark test as finished
+        status = store.update(data_collection_active=False, finished=True, test_end_time=clock.time())
         # Ensure a label is always set if not already set by processing
-        if not test_data['labels']:
-            if stop_requested:
-                test_data['labels'].append("Test Stopped by User")
+        if not status['labels']:
+            if status['stop_requested']:
+                add_label("Test Stopped by User")
             else:
-                test_data['labels'].append("No Classification (Test Interrupted or Error)")
-        
+                add_label("No Classification (Test Interrupted or Error)")
+        # If stopped manually, the /stop route archives the run
+        if not status['stop_requested']:
+            archive_run()
+
         print("Test Manager Thread Finished.")
 
+@timed_stage('classify')
 def process_test_results():
     """Centralized function to process results after test completion or stop."""
-    global state, test_data, classification_type, current_test_config
-    
+    classification_type = store.snapshot()['classification_type']
+
     if classification_type == 'soft_hard':
         process_soft_hard_classification()
     elif classification_type == 'fruit_freshness':
         process_fresh_rotten_classification()
     else:
-        test_data['labels'].append("Unknown Classification Type")
-        state = "Processing Error: Unknown Classification Type"
+        add_label("Unknown Classification Type", state="Processing Error: Unknown Classification Type")
 
 
 def process_soft_hard_classification():
-    global state, test_data
     try:
-        if not test_data['touch_data']:
-            test_data['labels'].append("No Touch Data Collected (Soft/Hard)")
-            test_data['average_peak_value'] = None # Set to None if no data
-            state = "No Touch Data for Classification"
+        status = store.snapshot()
+        touch_stats = store.cycle_stats('TOUCH') # Per-cycle RX statistics, kept in memory by the store
+        if not touch_stats['count'].sum():
+            # Set average to None if no data
+            add_label("No Touch Data Collected (Soft/Hard)", average_peak_value=None, state="No Touch Data for Classification")
             print("Soft/Hard: No touch data collected.")
             return
 
-        # Create DataFrame from collected touch data
-        df_touch_raw = pd.DataFrame(test_data['touch_data'], columns=["Time", "TX", "RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"])
-        
-        if df_touch_raw.empty:
-            test_data['labels'].append("No Valid Touch Data for Soft/Hard Classification")
-            test_data['average_peak_value'] = None # Set to None if empty DataFrame
-            state = "No Valid Touch Data"
-            print("Soft/Hard: No valid touch data in DataFrame.")
-            return
-
-        # Extract only RX columns for max calculation
-        rx_only_values = df_touch_raw.iloc[:, 2:9].values # Columns RX1 to RX7
-        
-        # Find the maximum value across all RX channels in the entire touch data period
-        if rx_only_values.size > 0:
-            max_val_in_touch_phase = rx_only_values.max()
-        else:
-            max_val_in_touch_phase = 0 
+        # One peak per cycle: the maximum across all RX channels within that cycle's touch phase
+        cycles, touch_max_array = scoring.cycle_peaks(touch_stats)
+        peak_summary = scoring.summarize_peaks(cycles, touch_max_array)
 
-        test_data['touch_max_array'].append(max_val_in_touch_phase) 
-
-        # Calculate the average of all recorded touch maximums
-        if test_data['touch_max_array']:
-            test_data['average_peak_value'] = np.mean(test_data['touch_max_array'])
-        else:
-            test_data['average_peak_value'] = 0 # Fallback to 0 if array becomes empty for some reason
+        # Average the touch peaks, leaving out cycles that are outliers (bad presses)
+        average_peak_value = peak_summary['mean']
 
         # Classify based on the average peak value against the threshold
-        is_hard = test_data['average_peak_value'] > current_test_config['threshold']
+        threshold = status['current_test_config']['threshold']
+        is_hard = average_peak_value > threshold
         label = "Hard" if is_hard else "Soft"
-        test_data['labels'].append(label)
-        state = f"Soft/Hard Classification: {label}"
-        print(f"Soft/Hard Classification: {label}, Average Peak: {test_data['average_peak_value']}")
+        peak_summary['confidence'] = scoring.confidence(peak_summary, average_peak_value, threshold)
+        add_label(label, touch_max_array=peak_summary['peaks'], average_peak_value=average_peak_value,
+                  peak_summary=peak_summary, state=f"Soft/Hard Classification: {label}")
+        print(f"Soft/Hard Classification: {label}, Average Peak: {average_peak_value}, "
+              f"Peaks per cycle: {peak_summary['peaks']}, Confidence: {peak_summary['confidence']}")
     except Exception as e:
-        state = f"Processing error (Soft/Hard): {str(e)}"
-        test_data['labels'].append("Error in Soft/Hard Classification")
-        test_data['average_peak_value'] = None # Ensure it's None on error
+        # Ensure average is None on error
+        add_label("Error in Soft/Hard Classification", average_peak_value=None, state=f"Processing error (Soft/Hard): {str(e)}")
         print(f"Error in Soft/Hard Classification: {e}")
         import traceback
         traceback.print_exc()
 
 def process_fresh_rotten_classification():
-    global state, test_data
     try:
-        if not test_data['touch_data']:
-            test_data['labels'].append("No Touch Data Collected (Fresh/Rotten)")
-            state = "No Touch Data for Classification"
+        status = store.snapshot()
+        touch_stats = store.cycle_stats('TOUCH')
+        if not touch_stats['count'].sum():
+            add_label("No Touch Data Collected (Fresh/Rotten)", state="No Touch Data for Classification")
             print("Fresh/Rotten: No touch data collected.")
             return
 
-        df_touch_raw = pd.DataFrame(test_data['touch_data'], columns=["Time", "TX", "RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"])
-        
-        if df_touch_raw.empty:
-            test_data['labels'].append("No Valid Touch Data for Fresh/Rotten Classification")
-            state = "No Valid Touch Data"
-            print("Fresh/Rotten: No valid touch data in DataFrame.")
-            return
-
-        rx_only_values = df_touch_raw.iloc[:, 2:9].values # Columns RX1 to RX7
-        
-        if rx_only_values.size > 0:
-            max_val_in_touch_phase = rx_only_values.max() # Overall max in the entire touch data
-        else:
-            max_val_in_touch_phase = 0 
+        cycles, touch_max_array = scoring.cycle_peaks(touch_stats)
+        peak_summary = scoring.summarize_peaks(cycles, touch_max_array)
+        max_val_in_touch_phase = peak_summary['max'] # Max over the inlier cycles, so one bad press cannot decide
 
-        test_data['touch_max_array'].append(max_val_in_touch_phase) 
-        
         # For Fresh/Rotten, typically we just use the max value observed, not an average
-        is_fresh = max_val_in_touch_phase > current_test_config['threshold']
+        threshold = status['current_test_config']['threshold']
+        is_fresh = max_val_in_touch_phase > threshold
         label = "Fresh" if is_fresh else "Rotten"
-        test_data['labels'].append(label)
-        state = f"Fresh/Rotten Classification: {label}"
-        print(f"Fresh/Rotten Classification: {label}, Max Value: {max_val_in_touch_phase}")
+        peak_summary['confidence'] = scoring.confidence(peak_summary, max_val_in_touch_phase, threshold)
+        add_label(label, touch_max_array=peak_summary['peaks'], peak_summary=peak_summary,
+                  state=f"Fresh/Rotten Classification: {label}")
+        print(f"Fresh/Rotten Classification: {label}, Max Value: {max_val_in_touch_phase}, "
+              f"Confidence: {peak_summary['confidence']}")
     except Exception as e:
-        state = f"Processing error (Fresh/Rotten): {str(e)}"
-        test_data['labels'].append("Error in Fresh/Rotten Classification")
+        add_label("Error in Fresh/Rotten Classification", state=f"Processing error (Fresh/Rotten): {str(e)}")
         print(f"Error in Fresh/Rotten Classification: {e}")
         import traceback
         traceback.print_exc()
 
+def write_csv(kind, path):
+    """Write one buffer to CSV a chunk at a time; returns the number of rows written."""
+    import pandas as pd
+    rows_written = 0
+    first_time = None
+    with open(path, 'w', newline='') as f:
+        for chunk in store.iter_chunks(kind):
+            df = pd.DataFrame(chunk, columns=SAMPLE_COLUMNS)
+            if first_time is None:
+                first_time = df["Time"].iloc[0]
+            df["NewTime"] = df["Time"] - first_time
+            df.to_csv(f, index=False, header=rows_written == 0)
+            rows_written += len(df)
+    return rows_written
+
+@timed_stage('save_csv')
 def save_csv():
-    global state, test_data
     try:
-        # Save all data
-        df_all = pd.DataFrame(test_data['all_data'], columns=["Time", "TX", "RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"])
-        if not df_all.empty:
-            df_all["NewTime"] = df_all["Time"] - df_all["Time"].iloc[0]
-            df_all.to_csv("all_data.csv", index=False)
-            print("all_data.csv saved.")
-        else:
-            print("No 'all_data' to save to CSV. Creating empty file.")
-            open("all_data.csv", 'w').close() # Create empty file
-
-        # Save untouch data
-        df_untouch = pd.DataFrame(test_data['untouch_data'], columns=["Time", "TX", "RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"])
-        if not df_untouch.empty:
-            df_untouch["NewTime"] = df_untouch["Time"] - df_untouch["Time"].iloc[0]
-            df_untouch.to_csv("untouch_data.csv", index=False)
-            print("untouch_data.csv saved.")
-        else:
-            print("No 'untouch_data' to save to CSV. Creating empty file.")
-            open("untouch_data.csv", 'w').close()
-
-        # Save touch data
-        df_touch = pd.DataFrame(test_data['touch_data'], columns=["Time", "TX", "RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"])
-        if not df_touch.empty:
-            df_touch["NewTime"] = df_touch["Time"] - df_touch["Time"].iloc[0]
-            df_touch.to_csv("touch_data.csv", index=False)
-            print("touch_data.csv saved.")
-        else:
-            print("No 'touch_data' to save to CSV. Creating empty file.")
-            open("touch_data.csv", 'w').close()
+        # Save all, untouch and touch data; a buffer without samples still gets an empty file
+        for kind in ('all_data', 'untouch_data', 'touch_data'):
+            if write_csv(kind, f"{kind}.csv"):
+                print(f"{kind}.csv saved.")
+            else:
+                print(f"No '{kind}' to save to CSV. Created empty file.")
+
+        # Save the per-cycle touch peaks behind the classification
+        peak_summary = store.snapshot()['peak_summary']
+        with open("cycle_peaks.csv", 'w') as f:
+            f.write("Cycle,Peak,Outlier\n")
+            if peak_summary:
+                for cycle, peak, outlier in zip(peak_summary['cycles'], peak_summary['peaks'], peak_summary['outliers']):
+                    f.write(f"{cycle},{peak},{outlier}\n")
+        print("cycle_peaks.csv saved.")
 
     except Exception as e:
-        state = f"Error saving CSVs: {str(e)}"
+        store.update(state=f"Error saving CSVs: {str(e)}")
         print(f"Error saving CSVs: {e}")
         import traceback
         traceback.print_exc()
 
+@timed_stage('save_parquet')
+def save_parquet():
+    try:
+        peak_summary = store.snapshot()['peak_summary']
+        for kind in ('all_data', 'untouch_data', 'touch_data'):
+            exports.save_parquet(store, kind, f"{kind}.parquet", metadata={'peak_summary': peak_summary})
+        print("Parquet exports saved.")
+    except ImportError:
+        print("pyarrow is not installed; skipping Parquet export.")
+    except Exception as e:
+        store.update(state=f"Error saving Parquet: {str(e)}")
+        print(f"Error saving Parquet: {e}")
+        import traceback
+        traceback.print_exc()
+
+def archive_run():
+    try:
+        status = store.snapshot()
+        started = time.perf_counter()
+        path = runs.save_run(store, status, stage_timer.report(status['run_id']))
+        print(f"Run archived to {path} in {time.perf_counter() - started:.3f}s")
+    except Exception as e:
+        print(f"Error archiving run: {e}")
+        import traceback
+        traceback.print_exc()
+
+@timed_stage('plot')
 def plot_all():
-    global state, test_data
     try:
-        if not test_data['all_data']:
-            state = "No data to plot."
+        total = store.sample_count()
+        if not total:
+            store.update(state="No data to plot.")
             print("No data available for plotting.")
             return
 
-        df = pd.DataFrame(test_data['all_data'], columns=["Time", "TX", "RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"])
-        df["NewTime"] = df["Time"] - df["Time"].iloc[0]
-        
+        # Plot the pyramid level that fits MAX_PLOT_POINTS rather than every raw sample:
+        # the mean of each bucket as a line and its min/max as a band
+        summary = store.history(0, None, MAX_PLOT_POINTS)
+
+        import matplotlib
+        matplotlib.use("Agg") # Render off-screen; the plot is only ever saved to a file
+        import matplotlib.pyplot as plt
+
+        classification_type = store.snapshot()['classification_type']
         plt.figure(figsize=(10, 6))
-        for col in ["RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"]:
-            plt.plot(df["NewTime"], df[col], label=col) # Corrected x-axis to "NewTime"
+        for i, col in enumerate(["RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"]):
+            line, = plt.plot(summary['time'], summary['mean'][:, i], label=col)
+            plt.fill_between(summary['time'], summary['min'][:, i], summary['max'][:, i], color=line.get_color(), alpha=0.15, linewidth=0)
         plt.xlabel("Time (ms)")
         plt.ylabel("Sensor Value")
         plt.title(f"Sensor Data ({'Soft/Hard' if classification_type == 'soft_hard' else 'Fresh/Rotten'})")
@@ -915,31 +588,97 @@ def plot_all():
         plt.close() # Close the figure to free memory
         print("Plot generated and saved to all_data_plot.png")
     except Exception as e:
-        state = f"Error generating plot: {str(e)}"
+        store.update(state=f"Error generating plot: {str(e)}")
         print(f"Error generating plot: {e}")
         import traceback
         traceback.print_exc()
 
+@app.route('/history')
+def history():
+    """min/max/mean of each RX channel over a time range, from the pre-aggregated pyramid.
+
+    start/end are ms after the first sample (default: the whole test) and points
+    caps the number of buckets; ?run=<run_id> reads an archived run instead of
+    the current test.
+    """
+    start_ms = request.args.get('start', 0, type=float)
+    end_ms = request.args.get('end', type=float)
+    max_points = min(max(request.args.get('points', 1000, type=int), 1), MAX_HISTORY_POINTS)
+    run_id = request.args.get('run')
+    if run_id:
+        try:
+            summary = runs.load_pyramid(run_id).query(start_ms, end_ms, max_points)
+        except (ValueError, FileNotFoundError):
+            return jsonify({"message": f"Run '{run_id}' not found."}), 404
+    else:
+        summary = store.history(start_ms, end_ms, max_points)
+    return jsonify({
+        "resolution_ms": summary['resolution_ms'],
+        "time": summary['time'].tolist(),
+        "count": summary['count'].tolist(),
+        "min": summary['min'].tolist(),
+        "max": summary['max'].tolist(),
+        "mean": summary['mean'].tolist()
+    })
+
+@app.route('/api/compare')
+def compare_runs():
+    """Aligned per-cycle touch curves, feature deltas and nearest-reference labels of archived runs.
+
+    ?runs=<run_id>,<run_id>,... lists the runs (deltas are against the first);
+    ?points= sets the resampled points per curve. Labelled archived runs of the
+    same classification type serve as references (see compare.py).
+    """
+    run_ids = [run_id for run_id in request.args.get('runs', '').split(',') if run_id]
+    if not run_ids:
+        return jsonify({"message": "Pass the runs to compare as ?runs=<run_id>,<run_id>,..."}), 400
+    points = min(max(request.args.get('points', compare.CURVE_POINTS, type=int), 2), compare.MAX_CURVE_POINTS)
+    try:
+        return jsonify(compare.compare_runs(run_ids, points))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 404
+
+def download_export(kind, label, download_stem):
+    """Send one buffer as ?format=csv (default), parquet or arrow.
+
+    CSV and Parquet come from the files written when the test finished and are
+    sent in chunks with Range support, so interrupted downloads can resume. The
+    Arrow IPC stream is generated chunk by chunk from the current sample buffers.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt == 'arrow':
+        try:
+            stream = exports.arrow_stream(store, kind)
+        except ImportError:
+            return "Arrow export requires pyarrow to be installed.", 501
+        return Response(stream, mimetype="application/vnd.apache.arrow.stream",
+                        headers={"Content-Disposition": f"attachment; filename={download_stem}.arrows"})
+    if fmt not in ('csv', 'parquet'):
+        return f"Unknown export format '{fmt}'. Use csv, parquet or arrow.", 400
+
+    file_path = os.path.abspath(f"{kind}.{fmt}")
+    if not os.path.exists(file_path):
+        return f"{label} {fmt.upper()} not found. Please ensure a test has run successfully.", 404
+    return send_file(file_path, as_attachment=True, download_name=f"{download_stem}.{fmt}", conditional=True)
+
 @app.route('/download_all')
 def download_all_csv():
-    file_path = os.path.abspath("all_data.csv")
-    if not os.path.exists(file_path):
-        return "All Data CSV not found. Please ensure a test has run successfully.", 404
-    return send_file(file_path, as_attachment=True, download_name="all_sensor_data.csv")
+    return download_export('all_data', "All Data", "all_sensor_data")
 
 @app.route('/download_touch')
 def download_touch_csv():
-    file_path = os.path.abspath("touch_data.csv")
-    if not os.path.exists(file_path):
-        return "Touch Data CSV not found. Please ensure a test has run successfully.", 404
-    return send_file(file_path, as_attachment=True, download_name="touch_sensor_data.csv")
+    return download_export('touch_data', "Touch Data", "touch_sensor_data")
 
 @app.route('/download_untouch')
 def download_untouch_csv():
-    file_path = os.path.abspath("untouch_data.csv")
+    return download_export('untouch_data', "Untouch Data", "untouch_sensor_data")
+
+@app.route('/download_cycles')
+def download_cycles_csv():
+    file_path = os.path.abspath("cycle_peaks.csv")
     if not os.path.exists(file_path):
-        return "Untouch Data CSV not found. Please ensure a test has run successfully.", 404
-    return send_file(file_path, as_attachment=True, download_name="untouch_sensor_data.csv")
+        return "Cycle Peaks CSV not found. Please ensure a test has run successfully.", 404
+    return send_file(file_path, as_attachment=True, download_name="cycle_peaks.csv")
 
 @app.route('/plot')
 def plot_img():
@@ -948,7 +687,59 @@ def plot_img():
         return "Plot not found. Please ensure a test has run successfully.", 404
     return send_file(plot_path, mimetype='image/png')
 
-if __name__ == '__main__':
-    # Run on all available IPs to be accessible from Arduino
-    # Set debug=False for production environments
-    app.run(debug=True, host='0.0.0.0', port=5000)
+@app.route('/healthz')
+def healthz():
+    # Readiness probe for rolling restarts: answers as soon as the worker has imported
+    return jsonify({
+        "ready": True,
+        "startup_seconds": round(startup_seconds, 3),
+        "startup_budget_seconds": STARTUP_BUDGET_SECONDS,
+        "heavy_modules_loaded": [m for m in ("pandas", "matplotlib.pyplot") if m in sys.modules],
+        "sample_memory": store.memory_usage()
+    })
+
+def admin_denied():
+    """Error response for an admin request without the right X-Admin-Token, else None."""
+    if not ADMIN_TOKEN:
+        return "Not found.", 404 # Admin routes do not exist unless a token is configured
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"message": "Invalid admin token."}), 403
+    return None
+
+@app.route('/admin/profile')
+def admin_profile():
+    """Sample every thread of this worker for ?seconds= and return the stacks.
+
+    ?format=collapsed (default) gives folded stacks for a flamegraph,
+    ?format=pstats a file for pstats/snakeviz. Blocks for the whole profile.
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), profiling.MAX_PROFILE_SECONDS)
+    fmt = request.args.get('format', 'collapsed')
+    if fmt not in ('collapsed', 'pstats'):
+        return jsonify({"message": f"Unknown profile format '{fmt}'. Use collapsed or pstats."}), 400
+
+    counts = profiling.sample_stacks(seconds)
+    if counts is None:
+        return jsonify({"message": "A profile is already running in this worker."}), 409
+    if fmt == 'pstats':
+        return Response(profiling.to_pstats(counts), mimetype="application/octet-stream",
+                        headers={"Content-Disposition": "attachment; filename=profile.pstats"})
+    return Response(profiling.to_collapsed(counts), mimetype="text/plain",
+                    headers={"Content-Disposition": "attachment; filename=profile.collapsed"})
+
+@app.route('/admin/stages')
+def admin_stages():
+    # Stage timers of the current run as recorded by this worker
+    denied = admin_denied()
+    if denied:
+        return denied
+    run_id = store.snapshot()['run_id']
+    return jsonify({"run_id": run_id, "stages": stage_timer.report(run_id)})
+
+startup_seconds = time.perf_counter() - _startup_began
+if startup_seconds > STARTUP_BUDGET_SECONDS:
+    print(f"Warning: startup took {startup_seconds:.2f}s, over the {STARTUP_BUDGET_SECONDS:.2f}s budget")
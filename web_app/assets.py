@@ -0,0 +1,100 @@
+"""Fingerprinted static assets and cached, pre-compressed responses.
+
+Every file under static/ is published as /assets/<dir>/<name>.<hash>.<ext>, so its
+URL changes whenever its content does and browsers may cache it for a year.
+Pages and assets are held in memory together with a gzip variant built on first
+use, and revalidations answered with 304 cost no rendering or disk access.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, request
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache" # May be stored, but must be revalidated with the ETag
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class CachedBody:
+    """A response body with its ETag and a lazily built gzip variant."""
+
+    def __init__(self, data, mimetype, etag=None):
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = etag or hashlib.sha256(data).hexdigest()[:16] # Defaults to the content hash
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.data, compresslevel=9, mtime=0)
+        return self._gzipped
+
+    @property
+    def compressible(self):
+        return self.mimetype.startswith(COMPRESSIBLE) and len(self.data) > 512
+
+
+def cached_response(body, cache_control):
+    """Serve a CachedBody, honouring If-None-Match and Accept-Encoding."""
+    use_gzip = body.compressible and request.accept_encodings["gzip"] > 0
+    etag = body.etag + "-gz" if use_gzip else body.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body.gzipped if use_gzip else body.data, mimetype=body.mimetype)
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    if body.compressible:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+_manifest = None # fingerprinted URL path -> CachedBody
+_urls = {} # path under static/ -> fingerprinted URL
+_manifest_lock = threading.Lock()
+
+
+def _build_manifest():
+    global _manifest
+    with _manifest_lock:
+        if _manifest is not None:
+            return
+        manifest = {}
+        for folder, _, files in os.walk(STATIC_DIR):
+            for filename in files:
+                full_path = os.path.join(folder, filename)
+                path = os.path.relpath(full_path, STATIC_DIR).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    data = f.read()
+                mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                body = CachedBody(data, mimetype)
+                stem, ext = os.path.splitext(path)
+                fingerprinted = f"{stem}.{body.etag[:10]}{ext}"
+                manifest[fingerprinted] = body
+                _urls[path] = "/assets/" + fingerprinted
+        _manifest = manifest
+
+
+def asset_url(path):
+    """Fingerprinted URL of a file under static/, for use in templates."""
+    if _manifest is None:
+        _build_manifest()
+    return _urls[path]
+
+
+def send_asset(fingerprinted):
+    """Response for /assets/<fingerprinted>, or None if there is no such asset."""
+    if _manifest is None:
+        _build_manifest()
+    body = _manifest.get(fingerprinted)
+    if body is None:
+        return None
+    return cached_response(body, IMMUTABLE)
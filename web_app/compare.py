@@ -0,0 +1,223 @@
+"""Compare archived runs by their per-cycle touch curves.
+
+A run's touch curve for one cycle is the highest RX value of each sample in
+that cycle's touch phase, on a time axis normalized to 0..1 over the phase and
+resampled onto a fixed grid, so cycles and runs of any duration or sample rate
+line up point for point. All cycles of a run are resampled with a single
+np.interp call.
+
+Runs are archived once and never change, so each run's profile (curves and
+features) is cached by its directory and meta.json mtime, and runs not yet
+cached are loaded in parallel. Profiles are cached at PROFILE_POINTS only and
+resampled to the requested points, so any ?points= reuses them. Requested runs are classified by their nearest
+labelled runs of the same classification type (RMS distance between mean
+curves).
+"""
+import collections
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import runs
+from state_store import SAMPLE_COLUMNS
+
+CURVE_POINTS = 100 # Default resampled points per curve
+MAX_CURVE_POINTS = 1000
+PROFILE_POINTS = MAX_CURVE_POINTS # Points per curve of cached profiles (and their features)
+NEIGHBOURS = 5 # Labelled runs voting on a run's classification
+REFERENCE_LABELS = ("Hard", "Soft", "Fresh", "Rotten")
+LOAD_WORKERS = min(8, (os.cpu_count() or 1) + 4) # np.load releases the GIL while reading
+
+_RX = slice(2, len(SAMPLE_COLUMNS)) # RX1..RX7 columns of an archived sample
+_PHASE = len(SAMPLE_COLUMNS)
+_CYCLE = _PHASE + 1
+
+
+def touch_curves(samples, grid):
+    """(cycles, peaks, curves) of the touch phases in an (n, 11) archived sample array.
+
+    curves is (cycles, len(grid)): each cycle's max-RX signal interpolated at
+    the normalized times in grid; peaks is each cycle's raw maximum.
+    """
+    touch = np.asarray(samples[samples[:, _PHASE] == runs.PHASE_CODES["TOUCH"]], dtype=np.float64)
+    if not len(touch):
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty((0, len(grid)))
+    touch = touch[np.lexsort((touch[:, 0], touch[:, _CYCLE]))]
+
+    cycles, starts = np.unique(touch[:, _CYCLE], return_index=True)
+    sizes = np.diff(np.append(starts, len(touch)))
+    group = np.repeat(np.arange(len(cycles)), sizes)
+    time = touch[:, 0]
+    first = np.minimum.reduceat(time, starts)
+    span = np.maximum.reduceat(time, starts) - first
+    normalized = (time - first[group]) / np.where(span > 0, span, 1.0)[group]
+    signal = touch[:, _RX].max(axis=1)
+
+    # Cycle i occupies [2i, 2i + 1] on one shared axis, so one interp covers every cycle
+    curves = np.interp((grid[None, :] + 2 * np.arange(len(cycles))[:, None]).ravel(),
+                       normalized + 2 * group, signal).reshape(len(cycles), len(grid))
+    peaks = np.maximum.reduceat(signal, starts)
+    # A cycle whose samples share one timestamp (one sample, or several) sits at a
+    # single point of the axis: a flat curve at its peak, not a ramp towards the next cycle
+    flat = span == 0
+    curves[flat] = peaks[flat][:, None]
+    return cycles.astype(np.int64), peaks, curves
+
+
+def curve_features(grid, peaks, curves, baseline):
+    """Scalar features of one run's touch curves; None where there is no touch data."""
+    if not len(curves):
+        return {'peak': None, 'peak_spread': None, 'mean_level': None, 'rise_time': None,
+                'baseline': baseline, 'contrast': None}
+    # First grid time each cycle reaches 90% of its curve's maximum
+    rising = curves >= 0.9 * curves.max(axis=1, keepdims=True)
+    peak = float(peaks.mean())
+    return {
+        'peak': peak,
+        'peak_spread': float(peaks.std()),
+        'mean_level': float(curves.mean()),
+        'rise_time': float(grid[rising.argmax(axis=1)].mean()),
+        'baseline': baseline,
+        'contrast': None if baseline is None else peak - baseline
+    }
+
+
+def resample(curves, points):
+    """Curves on an evenly spaced 0..1 grid, linearly resampled to `points` grid points."""
+    size = curves.shape[-1]
+    if points == size:
+        return curves
+    position = np.linspace(0.0, size - 1, points)
+    low = np.minimum(position.astype(np.int64), size - 2)
+    fraction = position - low
+    return curves[..., low] * (1 - fraction) + curves[..., low + 1] * fraction
+
+
+@functools.lru_cache(maxsize=4096)
+def _profile(path, mtime_ns):
+    meta, samples, _ = runs.open_run(path)
+    grid = np.linspace(0.0, 1.0, PROFILE_POINTS)
+    cycles, peaks, curves = touch_curves(samples, grid)
+    untouch = samples[samples[:, _PHASE] == runs.PHASE_CODES["UNTOUCH"]]
+    baseline = float(untouch[:, _RX].max(axis=1).mean()) if len(untouch) else None
+    return {
+        'run_id': meta['run_id'],
+        'label': meta['label'],
+        'classification_type': meta['classification_type'],
+        'config': meta['config'],
+        'cycles': cycles,
+        'peaks': peaks,
+        'curves': curves,
+        'mean_curve': curves.mean(axis=0) if len(curves) else None,
+        'features': curve_features(grid, peaks, curves, baseline)
+    }
+
+
+def _cached_profile(run_id):
+    path = runs.run_dir(run_id)
+    return _profile(path, os.stat(os.path.join(path, "meta.json")).st_mtime_ns)
+
+
+def run_profile(run_id, points=CURVE_POINTS):
+    """Curves and features of an archived run (raises ValueError/FileNotFoundError).
+
+    Features are those of the cached PROFILE_POINTS curves whatever `points` is.
+    """
+    profile = _cached_profile(run_id)
+    return dict(profile, curves=resample(profile['curves'], points),
+                mean_curve=None if profile['mean_curve'] is None else resample(profile['mean_curve'], points))
+
+
+def _load_references(points):
+    def load(run_id):
+        try:
+            return _cached_profile(run_id)
+        except Exception as e:
+            print(f"Skipping run {run_id} as a comparison reference: {e}")
+            return None
+
+    with ThreadPoolExecutor(LOAD_WORKERS) as pool:
+        profiles = list(pool.map(load, runs.list_runs()))
+    # Only mean curves take part in the distances, so only they are resampled
+    return [dict(p, mean_curve=resample(p['mean_curve'], points)) for p in profiles
+            if p and p['label'] in REFERENCE_LABELS and p['mean_curve'] is not None]
+
+
+def _nearest(profiles, references):
+    """Nearest labelled references of each profile, from one (runs, references) distance matrix."""
+    results = [None] * len(profiles)
+    curved = [i for i, p in enumerate(profiles) if p['mean_curve'] is not None]
+    if not curved or not references:
+        return results
+    curves = np.stack([profiles[i]['mean_curve'] for i in curved])
+    reference_curves = np.stack([r['mean_curve'] for r in references])
+    # RMS distance as |a|^2 + |b|^2 - 2ab, without a (runs, references, points) temporary
+    squared = ((curves ** 2).sum(axis=1)[:, None] + (reference_curves ** 2).sum(axis=1)[None, :]
+               - 2 * curves @ reference_curves.T)
+    distances = np.sqrt(np.maximum(squared, 0) / curves.shape[1])
+
+    reference_ids = np.array([r['run_id'] for r in references])
+    reference_types = np.array([r['classification_type'] for r in references])
+    for row, i in enumerate(curved):
+        profile = profiles[i]
+        # Only runs of the same classification type, never the run itself
+        usable = (reference_types == profile['classification_type']) & (reference_ids != profile['run_id'])
+        candidates = np.flatnonzero(usable)
+        if not len(candidates):
+            continue
+        order = candidates[np.argsort(distances[row, candidates], kind="stable")[:NEIGHBOURS]]
+        votes = collections.Counter(references[j]['label'] for j in order)
+        nearest = references[order[0]]
+        # Most votes wins; a tie goes to the label of the closest run
+        top = max(votes.values())
+        label = next(references[j]['label'] for j in order if votes[references[j]['label']] == top)
+        results[i] = {
+            'classification': label,
+            'votes': dict(votes),
+            'nearest': {'run_id': nearest['run_id'], 'label': nearest['label'],
+                        'distance': float(distances[row, order[0]])},
+            'neighbours': [{'run_id': references[j]['run_id'], 'label': references[j]['label'],
+                            'distance': float(distances[row, j])} for j in order]
+        }
+    return results
+
+
+def compare_runs(run_ids, points=CURVE_POINTS):
+    """Curves, feature deltas against the first run and nearest references of run_ids."""
+    def load(run_id):
+        try:
+            return run_profile(run_id, points)
+        except (ValueError, FileNotFoundError):
+            raise ValueError(f"Run '{run_id}' not found.")
+
+    with ThreadPoolExecutor(LOAD_WORKERS) as pool:
+        profiles = list(pool.map(load, run_ids))
+    references = _load_references(points)
+    nearest = _nearest(profiles, references)
+
+    baseline = profiles[0]['features']
+    result = []
+    for profile, match in zip(profiles, nearest):
+        features = profile['features']
+        result.append({
+            'run_id': profile['run_id'],
+            'label': profile['label'],
+            'classification_type': profile['classification_type'],
+            'config': profile['config'],
+            'cycles': profile['cycles'].tolist(),
+            'peaks': profile['peaks'].tolist(),
+            'curves': profile['curves'].tolist(),
+            'mean_curve': None if profile['mean_curve'] is None else profile['mean_curve'].tolist(),
+            'features': features,
+            'deltas': {name: None if value is None or baseline[name] is None else value - baseline[name]
+                       for name, value in features.items()},
+            'reference': match
+        })
+    return {
+        'time': np.linspace(0.0, 1.0, points).tolist(),
+        'baseline_run': profiles[0]['run_id'],
+        'reference_runs': len(references),
+        'runs': result
+    }
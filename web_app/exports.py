@@ -0,0 +1,79 @@
+"""Columnar exports (Parquet and Arrow IPC stream) built straight from the sample buffers.
+
+Both read the store chunk by chunk, so a long run is never held in memory as a
+whole. pyarrow is imported on first use, like pandas in save_csv, so it adds
+nothing to worker startup.
+"""
+import io
+import json
+import os
+
+import numpy as np
+
+from state_store import SAMPLE_COLUMNS
+
+EXPORT_COLUMNS = SAMPLE_COLUMNS + ["NewTime"] # Same columns as the CSV exports
+PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+CHUNK_ROWS = 65536 # Samples per Arrow record batch / Parquet row group
+
+
+def _pyarrow():
+    import pyarrow as pa
+    return pa
+
+
+def _schema(pa, metadata=None):
+    # metadata values are stored as JSON in the file's key-value metadata
+    return pa.schema([(name, pa.float64()) for name in EXPORT_COLUMNS],
+                     metadata={key: json.dumps(value) for key, value in (metadata or {}).items()})
+
+
+def _record_batches(pa, store, kind):
+    schema = _schema(pa)
+    first_time = None
+    for rows in store.iter_chunks(kind, CHUNK_ROWS):
+        columns = np.asfortranarray(rows, dtype=np.float64)
+        if first_time is None:
+            first_time = columns[0, 0]
+        arrays = [pa.array(columns[:, i]) for i in range(columns.shape[1])]
+        arrays.append(pa.array(columns[:, 0] - first_time)) # NewTime
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def save_parquet(store, kind, path, metadata=None):
+    """Write one buffer to a Parquet file, one row group per chunk, with optional metadata."""
+    pa = _pyarrow()
+    import pyarrow.parquet as pq
+
+    tmp_path = path + ".tmp"
+    with pq.ParquetWriter(tmp_path, _schema(pa, metadata), compression=PARQUET_COMPRESSION) as writer:
+        for batch in _record_batches(pa, store, kind):
+            writer.write_batch(batch)
+    os.replace(tmp_path, path) # Never serve a half-written file
+
+
+def arrow_stream(store, kind):
+    """Return a generator of Arrow IPC stream bytes for one buffer.
+
+    pyarrow is imported before the generator is returned, so a missing
+    dependency surfaces as ImportError here rather than mid-response.
+    """
+    pa = _pyarrow()
+
+    def generate():
+        sink = io.BytesIO()
+
+        def drain():
+            data = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return data
+
+        with pa.ipc.new_stream(sink, _schema(pa)) as writer:
+            yield drain() # Schema message
+            for batch in _record_batches(pa, store, kind):
+                writer.write_batch(batch)
+                yield drain()
+        yield drain() # End-of-stream marker
+
+    return generate()
@@ -0,0 +1,7 @@
+"""gunicorn settings from the environment, shared with `python serve.py` (see serve.py).
+
+gunicorn reads this file by default when started from web_app/.
+"""
+import serve
+
+globals().update(serve.gunicorn_options(serve.load_settings()))
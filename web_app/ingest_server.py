@@ -0,0 +1,240 @@
+"""asyncio front end for devices that stream TX batches over long-lived connections.
+
+Each /api/post request costs the Arduino a connection and the server a thread.
+Here a device keeps one connection open and sends one frame per batch: a line
+holding the same JSON list of TX packets it would POST (a single packet object
+is accepted too). Every frame is answered with a JSON line
+{"message": ..., "status": <HTTP status /api/post would give>}. Frames go
+through app.ingest_packets, so batches land in the same store, phases and
+classifiers as posted ones, and one event loop holds any number of idle
+connections.
+
+Two transports:
+
+* raw TCP (no dependencies):  printf '[{"time":1,"tx":0,"rx":[1,2,3,4,5,6,7]}]\\n' | nc host 5001
+* HTTP through the ASGI app `asgi_app` (needs an ASGI server such as uvicorn):
+  POST /api/stream with a chunked body of frames, answered with a streamed
+  application/x-ndjson body; POST /api/post behaves like the Flask route.
+
+Run standalone next to the Flask workers, sharing DIGITAL_TOUCH_STORE with them
+(a separate process cannot see the in-memory store, so main() and asgi_app
+refuse to serve without it):
+
+    DIGITAL_TOUCH_STORE=/dev/shm/digital_touch.sqlite python ingest_server.py --tcp-port 5001 --http-port 5002
+
+or set INGEST_TCP_PORT for serve.py to serve TCP from a thread inside each app process.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+
+MAX_FRAME_BYTES = 1024 * 1024 # Longest accepted frame (line)
+
+
+async def handle_frame(ingest, line):
+    """Decode one frame and ingest it off the event loop; returns the reply dict."""
+    try:
+        packets = json.loads(line)
+    except ValueError as e:
+        return {"message": f"Invalid JSON frame: {e}", "status": 400}
+    if isinstance(packets, dict):
+        packets = [packets]
+    try:
+        # The store may block (SQLite, spilling), so it runs in the default thread pool
+        message, status = await asyncio.to_thread(ingest, packets)
+    except Exception as e:
+        print(f"Error processing batch data: {e}")
+        return {"message": f"Server error: {str(e)}", "status": 500}
+    return {"message": message, "status": status}
+
+
+def _reply(result):
+    return (json.dumps(result) + "\n").encode()
+
+
+async def serve_tcp(ingest, host, port):
+    """Serve newline-delimited frames on a TCP port until cancelled."""
+
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError: # Frame longer than MAX_FRAME_BYTES
+                    writer.write(_reply({"message": f"Frame longer than {MAX_FRAME_BYTES} bytes.", "status": 413}))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                writer.write(_reply(await handle_frame(ingest, line)))
+                await writer.drain() # Stop reading from a device that does not read its replies
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # SO_REUSEPORT lets every worker process bind the same port and share connections
+    server = await asyncio.start_server(handle_connection, host, port, limit=MAX_FRAME_BYTES,
+                                        reuse_port=hasattr(socket, "SO_REUSEPORT"))
+    print(f"Ingesting TCP frames on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def start_in_thread(ingest, host, port):
+    """Run serve_tcp on its own event loop in a daemon thread."""
+    thread = threading.Thread(target=asyncio.run, args=(serve_tcp(ingest, host, port),),
+                              name="ingest-tcp", daemon=True)
+    thread.start()
+    return thread
+
+
+def make_asgi_app(ingest):
+    """ASGI app serving POST /api/stream (chunked frames) and POST /api/post."""
+
+    async def send_json(send, status, body):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(body).encode()})
+
+    async def stream(receive, send):
+        # Answer each frame as soon as it is ingested, while the body is still arriving
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")]})
+        pending = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            pending += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            *lines, pending = pending.split(b"\n")
+            if not more_body:
+                lines.append(pending)
+            elif len(pending) > MAX_FRAME_BYTES:
+                await send({"type": "http.response.body",
+                            "body": _reply({"message": f"Frame longer than {MAX_FRAME_BYTES} bytes.", "status": 413})})
+                return
+            for line in lines:
+                if line.strip():
+                    await send({"type": "http.response.body", "body": _reply(await handle_frame(ingest, line)),
+                                "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def post(receive, send):
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) > MAX_FRAME_BYTES:
+                await send_json(send, 413, {"message": f"Frame longer than {MAX_FRAME_BYTES} bytes."})
+                return
+        result = await handle_frame(ingest, body)
+        await send_json(send, result["status"], {"message": result["message"]})
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        if scope["type"] != "http":
+            return
+        if scope["method"] != "POST" or scope["path"] not in ("/api/stream", "/api/post"):
+            await send_json(send, 404, {"message": "Not found."})
+        elif scope["path"] == "/api/stream":
+            await stream(receive, send)
+        else:
+            await post(receive, send)
+
+    return app
+
+
+def shared_store_error():
+    """Why this process cannot ingest on its own, or None when DIGITAL_TOUCH_STORE is set.
+
+    A separate process with a private in-memory store never sees /start, so
+    every frame would be answered "Data collection not active."
+    """
+    if os.environ.get("DIGITAL_TOUCH_STORE"):
+        return None
+    return ("DIGITAL_TOUCH_STORE must point at the store the Flask workers use "
+            "(or set INGEST_TCP_PORT for serve.py to ingest inside the app process).")
+
+
+async def refuse(scope, receive, send, error):
+    """ASGI app that fails lifespan startup and answers every request 503 with `error`."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.failed", "message": error})
+                return
+            if message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] == "http":
+        await send({"type": "http.response.start", "status": 503,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps({"message": error}).encode()})
+
+
+_asgi_app = None
+
+
+async def asgi_app(scope, receive, send):
+    """make_asgi_app(app.ingest_packets), built on first use: uvicorn ingest_server:asgi_app
+
+    Refuses to serve (see shared_store_error) without DIGITAL_TOUCH_STORE.
+    """
+    global _asgi_app
+    if _asgi_app is None:
+        error = shared_store_error()
+        if error:
+            print(f"Not ingesting: {error}")
+            await refuse(scope, receive, send, error)
+            return
+        from app import ingest_packets
+        _asgi_app = make_asgi_app(ingest_packets)
+    await _asgi_app(scope, receive, send)
+
+
+async def _serve(args, ingest):
+    servers = [serve_tcp(ingest, args.host, args.tcp_port)]
+    if args.http_port:
+        import uvicorn # Only needed for the HTTP transport
+        config = uvicorn.Config(make_asgi_app(ingest), host=args.host, port=args.http_port, log_level="warning")
+        servers.append(uvicorn.Server(config).serve())
+        print(f"Ingesting HTTP streams on {args.host}:{args.http_port}")
+    await asyncio.gather(*servers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream TX batches from devices over TCP or chunked HTTP.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--tcp-port", type=int, default=5001, help="port for newline-delimited frames (default 5001)")
+    parser.add_argument("--http-port", type=int, help="also serve the ASGI app on this port (requires uvicorn)")
+    args = parser.parse_args(argv)
+    error = shared_store_error()
+    if error:
+        parser.error(error)
+
+    from app import ingest_packets
+    try:
+        asyncio.run(_serve(args, ingest_packets))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
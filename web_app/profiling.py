@@ -0,0 +1,130 @@
+"""Stage timers for each run and an on-demand sampling profiler.
+
+StageTimer adds up the wall and CPU seconds (time.thread_time, so only the
+thread doing the work is charged) spent in named stages of the current run;
+the totals are archived in the run's meta.json.
+
+sample_stacks() reads the stack of every thread from sys._current_frames()
+every `interval` seconds. Nothing is hooked into the profiled code, so the
+overhead is one stack walk per thread per sample and nothing at all while no
+profile is running. The samples can be written out as collapsed stacks (for
+flamegraph.pl, speedscope or similar) or as a pstats file.
+"""
+import collections
+import marshal
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_PROFILE_SECONDS = 60 # Longest a single profile may run
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_MS", "10")) / 1000.0
+
+_profiling = threading.Lock() # Held while a profile runs; one at a time per process
+
+
+class StageTimer:
+    """Calls, wall seconds and CPU seconds per stage, for the latest run seen."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._run_id = None
+        self._stages = {}
+
+    @contextmanager
+    def stage(self, run_id, name):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.record(run_id, name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def record(self, run_id, name, wall_seconds, cpu_seconds):
+        with self._lock:
+            if run_id != self._run_id: # A new run starts from zero
+                self._run_id = run_id
+                self._stages = {}
+            entry = self._stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+            entry['calls'] += 1
+            entry['wall_seconds'] += wall_seconds
+            entry['cpu_seconds'] += cpu_seconds
+
+    def report(self, run_id):
+        """Totals recorded for run_id, empty if this process has recorded none."""
+        with self._lock:
+            if run_id != self._run_id:
+                return {}
+            return {name: {'calls': entry['calls'],
+                           'wall_seconds': round(entry['wall_seconds'], 6),
+                           'cpu_seconds': round(entry['cpu_seconds'], 6)}
+                    for name, entry in self._stages.items()}
+
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL_SECONDS):
+    """Sample all threads but the caller for `seconds`.
+
+    Returns a Counter of (thread name, stack) -> samples, where a stack is a
+    tuple of (filename, first line, function) from the outermost frame in, or
+    None if another profile is already running in this process.
+    """
+    if not _profiling.acquire(blocking=False):
+        return None
+    try:
+        counts = collections.Counter()
+        me = threading.get_ident()
+        deadline = time.perf_counter() + min(seconds, MAX_PROFILE_SECONDS)
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                counts[(names.get(ident, f"thread-{ident}"), tuple(reversed(stack)))] += 1
+            time.sleep(interval)
+        return counts
+    finally:
+        _profiling.release()
+
+
+def to_collapsed(counts):
+    """Collapsed stacks, one 'thread;outer;...;inner samples' line per stack."""
+    lines = []
+    for (thread, stack), n in sorted(counts.items()):
+        frames = [thread] + [f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in stack]
+        lines.append(f"{';'.join(frames)} {n}\n")
+    return "".join(lines)
+
+
+def to_pstats(counts, interval=PROFILE_INTERVAL_SECONDS):
+    """The samples as a marshalled pstats table, loadable with pstats.Stats(path).
+
+    Call counts are sample counts; times are samples times the interval. A
+    function appearing several times in one stack (recursion) is counted once.
+    """
+    stats = {} # function -> [primitive calls, calls, own time, cumulative time, {caller: [same four]}]
+    for (thread, stack), n in counts.items():
+        seconds = n * interval
+        seen = set()
+        for depth, func in enumerate(stack):
+            entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+            leaf = depth == len(stack) - 1
+            if func not in seen:
+                seen.add(func)
+                entry[0] += n
+                entry[1] += n
+                entry[3] += seconds
+            if leaf:
+                entry[2] += seconds
+            if depth:
+                edge = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                edge[0] += n
+                edge[1] += n
+                edge[2] += seconds if leaf else 0.0
+                edge[3] += seconds
+    return marshal.dumps({func: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.items()})
+                          for func, (cc, nc, tt, ct, callers) in stats.items()})
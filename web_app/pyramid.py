@@ -0,0 +1,225 @@
+"""Time-bucketed min/max/mean of every RX channel at several resolutions.
+
+Samples are added batch by batch as they arrive. Each level keeps, per bucket
+of its resolution, the sample count and the min, max and sum of every RX
+channel, with buckets counted from the first sample's device time. Any time
+range can then be summarized by reading the coarsest level that still gives
+the requested number of points, however long the run is.
+
+Memory stays bounded: the coarsest level covers the whole run, but every
+finer one only keeps its newest PYRAMID_WINDOW_BUCKETS buckets (fewer under a
+store memory limit, see window_for), and older ranges are answered from a
+coarser level. Device time that jumps forward by more
+than PYRAMID_MAX_GAP_MS, or back by more than MAX_BACKSTEP_MS (a clock
+restart), does not open a gap or pile samples into bucket 0: the pyramid
+carries on from the previous sample.
+
+A saved pyramid is a directory with index.json and one .npy file per level
+and statistic, so a query on an archived run memory-maps only the level it
+reads.
+"""
+import json
+import os
+
+import numpy as np
+
+RESOLUTIONS_MS = tuple(int(r) for r in os.environ.get("PYRAMID_RESOLUTIONS_MS", "10,100,1000,10000").split(","))
+WINDOW_BUCKETS = int(os.environ.get("PYRAMID_WINDOW_BUCKETS", "16384")) # ~2.9 MB per windowed level
+MAX_GAP_MS = float(os.environ.get("PYRAMID_MAX_GAP_MS", "60000")) # Longer steps forward are clock jumps
+MAX_BACKSTEP_MS = 1000 # Longer steps back are clock restarts, shorter ones late samples
+CHANNELS = 7
+STATISTICS = {'count': 0, 'min': np.inf, 'max': -np.inf, 'sum': 0.0} # Name -> value of an empty bucket
+BUCKET_BYTES = 8 + 3 * CHANNELS * 8 # count, min, max and sum of one bucket
+
+
+def window_for(max_bytes, resolutions=RESOLUTIONS_MS):
+    """Window (in buckets) that keeps the windowed levels within about max_bytes."""
+    windowed = max(len(resolutions) - 1, 1)
+    return max(min(WINDOW_BUCKETS, max_bytes // (BUCKET_BYTES * windowed)), 64)
+
+
+class Level:
+    """Bucket statistics at one resolution, for the whole run or its newest `window` buckets."""
+
+    def __init__(self, resolution_ms, window=None, capacity=1024):
+        self.resolution_ms = resolution_ms
+        self.window = window
+        self.base = 0 # Bucket held at index 0 of the arrays
+        self.used = 0 # Buckets up to the latest sample
+        capacity = capacity if window is None else min(capacity, window)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.min = np.full((capacity, CHANNELS), np.inf)
+        self.max = np.full((capacity, CHANNELS), -np.inf)
+        self.sum = np.zeros((capacity, CHANNELS))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in STATISTICS)
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self.count))
+        if self.window is not None:
+            capacity = min(capacity, self.window)
+        extra = capacity - len(self.count)
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.min = np.concatenate([self.min, np.full((extra, CHANNELS), np.inf)])
+        self.max = np.concatenate([self.max, np.full((extra, CHANNELS), -np.inf)])
+        self.sum = np.concatenate([self.sum, np.zeros((extra, CHANNELS))])
+
+    def _shift(self, base):
+        """Drop the buckets before `base`, moving the rest to the front of the arrays."""
+        shift = base - self.base
+        keep = max(min(self.used, self.base + len(self.count)) - base, 0)
+        for name, empty in STATISTICS.items():
+            array = getattr(self, name)
+            array[:keep] = array[shift:shift + keep]
+            array[keep:] = empty
+        self.base = base
+
+    def add(self, elapsed_ms, rx):
+        buckets = (elapsed_ms // self.resolution_ms).astype(np.int64)
+        needed = int(buckets.max()) + 1
+        if self.window is not None and needed - self.base > self.window:
+            # Slide the window, keeping half of it free so this happens rarely
+            self._shift(max(needed - self.window, min(int(buckets.min()), needed - self.window // 2)))
+        if buckets.min() < self.base: # Late samples for buckets already dropped
+            recent = buckets >= self.base
+            buckets, rx = buckets[recent], rx[recent]
+            if not len(buckets):
+                return
+        if needed - self.base > len(self.count):
+            self._grow(needed - self.base)
+        self.used = max(self.used, needed)
+        buckets = buckets - self.base
+
+        if np.all(buckets[1:] >= buckets[:-1]):
+            # In-order batch (the usual case): reduce each run of equal buckets at once
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+            index = buckets[starts]
+            self.count[index] += np.diff(np.append(starts, len(buckets)))
+            self.min[index] = np.minimum(self.min[index], np.minimum.reduceat(rx, starts))
+            self.max[index] = np.maximum(self.max[index], np.maximum.reduceat(rx, starts))
+            self.sum[index] += np.add.reduceat(rx, starts)
+        else:
+            np.add.at(self.count, buckets, 1)
+            np.minimum.at(self.min, buckets, rx)
+            np.maximum.at(self.max, buckets, rx)
+            np.add.at(self.sum, buckets, rx)
+
+    def covers(self, start_ms):
+        return start_ms >= self.base * self.resolution_ms
+
+    def summary(self, first, last):
+        """Non-empty buckets in [first, last] as a dict of arrays."""
+        first, last = max(first, self.base), min(last, self.used - 1)
+        if last < first:
+            index = np.empty(0, dtype=np.int64)
+        else:
+            index = first - self.base + np.flatnonzero(self.count[first - self.base:last - self.base + 1])
+        count = np.asarray(self.count[index])
+        return {
+            'time': (index + self.base) * self.resolution_ms,
+            'count': count,
+            'min': np.asarray(self.min[index]),
+            'max': np.asarray(self.max[index]),
+            'mean': self.sum[index] / count[:, None] if len(index) else np.asarray(self.sum[index])
+        }
+
+    def _file(self, path, name):
+        return os.path.join(path, f"{name}_{self.resolution_ms}.npy")
+
+    def save(self, path):
+        for name in STATISTICS:
+            np.save(self._file(path, name), getattr(self, name)[:max(self.used - self.base, 0)])
+
+    def open(self, path):
+        """Memory-map this level's arrays from a saved pyramid directory."""
+        for name in STATISTICS:
+            # np.load cannot map a zero-length array
+            setattr(self, name, np.load(self._file(path, name), mmap_mode="r" if self.used > self.base else None))
+
+
+class Pyramid:
+    """One Level per resolution, all fed from the same samples."""
+
+    def __init__(self, resolutions=RESOLUTIONS_MS, window=WINDOW_BUCKETS):
+        self.origin = None # Device time (ms) of the first sample
+        self._last_time = None # Device time of the latest sample
+        self._last_elapsed = 0.0 # ... and where the pyramid placed it
+        self._path = None # Directory of a loaded pyramid, whose levels are opened on first use
+        resolutions = sorted(resolutions)
+        self.levels = [Level(r, None if r == resolutions[-1] else window) for r in resolutions]
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels if level.count is not None)
+
+    def add(self, rows):
+        """Add an (n, 9) array of samples (Time, TX, RX1..RX7)."""
+        if not len(rows):
+            return
+        time = rows[:, 0].astype(np.float64)
+        if self.origin is None:
+            self.origin = self._last_time = float(time[0])
+        # Place samples by their step from the previous one, so a jump in device
+        # time is replaced by a zero step instead of allocating or collapsing buckets
+        step = np.diff(time, prepend=self._last_time)
+        jumps = (step > MAX_GAP_MS) | (step < -MAX_BACKSTEP_MS)
+        if jumps.any():
+            print(f"Device time jumped by {', '.join(f'{s:+.0f} ms' for s in step[jumps][:3])}; "
+                  f"the pyramid carries on from the previous sample")
+            step[jumps] = 0
+        elapsed_ms = self._last_elapsed + np.cumsum(step)
+        self._last_time, self._last_elapsed = float(time[-1]), float(elapsed_ms[-1])
+        # Samples timed slightly before the first one go in bucket 0
+        elapsed_ms = np.maximum(elapsed_ms, 0)
+        rx = rows[:, 2:].astype(np.float64)
+        for level in self.levels:
+            level.add(elapsed_ms, rx)
+
+    @property
+    def duration_ms(self):
+        finest = self.levels[0]
+        return finest.used * finest.resolution_ms
+
+    def query(self, start_ms=0, end_ms=None, max_points=1000):
+        """Summarize [start_ms, end_ms) (ms after the first sample) in at most max_points buckets.
+
+        Uses the finest level that fits and still holds start_ms, or the
+        coarsest one if none does.
+        """
+        if end_ms is None:
+            end_ms = self.duration_ms
+        span = max(end_ms - start_ms, 1)
+        level = next((l for l in self.levels if span / l.resolution_ms <= max_points and l.covers(start_ms)),
+                     self.levels[-1])
+        if level.count is None:
+            level.open(self._path)
+        result = level.summary(int(start_ms // level.resolution_ms), int(-(-end_ms // level.resolution_ms)) - 1)
+        result['resolution_ms'] = level.resolution_ms
+        return result
+
+    def save(self, path):
+        """Write index.json and one .npy per level and statistic into directory `path`."""
+        os.makedirs(path, exist_ok=True)
+        for level in self.levels:
+            level.save(path)
+        index = {'origin': self.origin,
+                 'levels': [{'resolution_ms': l.resolution_ms, 'window': l.window, 'base': l.base, 'used': l.used}
+                            for l in self.levels]}
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump(index, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        """A read-only pyramid over a saved directory; each level is memory-mapped when first queried."""
+        with open(os.path.join(path, "index.json")) as f:
+            index = json.load(f)
+        pyramid = cls([l['resolution_ms'] for l in index['levels']])
+        pyramid.origin = index['origin']
+        pyramid._path = path
+        for level, saved in zip(pyramid.levels, index['levels']):
+            level.window, level.base, level.used = saved['window'], saved['base'], saved['used']
+            for name in STATISTICS:
+                setattr(level, name, None)
+        return pyramid
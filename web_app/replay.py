@@ -0,0 +1,243 @@
+"""Replay a recorded session through the ingestion path, without hardware.
+
+A session is an archived run (a runs/<run_id> directory, see runs.py) or an
+exported all_data.csv. Its batches are posted to /api/post of an in-process
+app while run_test_manager switches phases on a replay clock, and the label the
+classifier produces is compared with the recorded one:
+
+    python replay.py runs/20250704-101500-123              # original timing
+    python replay.py runs/20250704-101500-123 --speed 10   # 10x faster
+    python replay.py runs/* --fast                         # as fast as possible
+    python replay.py all_data.csv --fast --cycles 3 --duration 5 --expect Hard
+
+--fast steps time batch by batch instead of sleeping, so phase switching is
+deterministic and a run replays at many times real-time speed. CSVs, plots and
+archived runs produced by a replay go to a temporary directory (or --workdir),
+never next to real runs, and the replay never touches a shared
+DIGITAL_TOUCH_STORE. Exits with status 1 if any label does not match.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import runs
+from state_store import MemoryStore
+
+
+class ScaledClock:
+    """Wall clock running `speed` times faster than real time."""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self._origin = time.time()
+        self._started = time.perf_counter()
+
+    def time(self):
+        return self._origin + (time.perf_counter() - self._started) * self.speed
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+
+class SteppedClock:
+    """Clock that only moves when the replay advances it.
+
+    The test manager's sleep() blocks until the replay has moved time past its
+    deadline; advance() then waits for the manager to go back to sleep before
+    returning, so every batch is posted after any phase switch that is due.
+    """
+
+    TICK = 0.1 # Largest step, matching the test manager's polling interval
+
+    def __init__(self, start):
+        self._now = start
+        self._deadline = None # Wake-up time of the sleeping test manager
+        self._changed = threading.Condition()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        with self._changed:
+            self._deadline = self._now + seconds
+            self._changed.notify_all()
+            self._changed.wait_for(lambda: self._now >= self._deadline)
+            self._deadline = None
+
+    def advance(self, to, thread):
+        """Move time forward to `to` one tick at a time, letting `thread` catch up."""
+        while True:
+            with self._changed:
+                if self._now >= to:
+                    return
+                self._now = min(to, self._now + self.TICK)
+                self._changed.notify_all()
+            self._settle(thread)
+
+    def _settle(self, thread):
+        # Wait until the thread sleeps with a deadline still ahead, or has finished
+        with self._changed:
+            while thread.is_alive() and (self._deadline is None or self._deadline <= self._now):
+                self._changed.wait(0.005)
+
+
+def load_session(source, batch_ms=100):
+    """Read a session into a dict with its batches and test configuration.
+
+    batches is a list of (seconds after test start, (n, 9) sample array). An
+    archived run keeps its original batches and arrival times; a CSV has
+    neither, so its samples are grouped into batch_ms windows of device time
+    and replayed as if the first sample arrived when the test started.
+    """
+    if os.path.isdir(source):
+        meta, samples, batch_log = runs.open_run(source)
+        ends = np.cumsum(batch_log[:, 1].astype(np.int64))
+        starts = ends - batch_log[:, 1].astype(np.int64)
+        batches = [(offset, samples[start:end, :9]) for offset, start, end in zip(batch_log[:, 0], starts, ends)]
+        return {
+            'source': source,
+            'classification_type': meta['classification_type'],
+            'config': meta['config'],
+            'expected': meta['label'],
+            'batches': batches
+        }
+
+    samples = np.loadtxt(source, delimiter=",", skiprows=1, usecols=range(9), ndmin=2)
+    batches = []
+    if len(samples):
+        elapsed_ms = samples[:, 0] - samples[0, 0]
+        window = (elapsed_ms // batch_ms).astype(np.int64)
+        # A new batch starts wherever the window index changes
+        bounds = np.flatnonzero(np.diff(window)) + 1
+        for rows in np.split(samples, bounds):
+            batches.append(((rows[-1, 0] - samples[0, 0]) / 1000.0, rows))
+    return {
+        'source': source,
+        'classification_type': "soft_hard",
+        'config': {},
+        'expected': None,
+        'batches': batches
+    }
+
+
+def to_packets(rows):
+    """Turn sample rows back into the JSON the Arduino posts."""
+    if np.array_equal(rows, np.round(rows)):
+        rows = rows.astype(np.int64)
+    return [{"time": row[0], "tx": row[1], "rx": row[2:]} for row in rows.tolist()]
+
+
+def replay(session, speed=1.0, fast=False):
+    """Run one session through the app and return a report dict."""
+    # A shared DIGITAL_TOUCH_STORE may hold a live test that /start would reset,
+    # so replays always run against a private in-process store
+    os.environ.pop("DIGITAL_TOUCH_STORE", None)
+    import app as server
+    if not isinstance(server.store, MemoryStore):
+        server.store = MemoryStore(server.IDLE_STATUS)
+
+    config = session['config']
+    clock = SteppedClock(time.time()) if fast else ScaledClock(speed)
+    server.clock = clock
+    client = server.app.test_client()
+    try:
+        client.post('/start', json={
+            'classification_type': session['classification_type'],
+            'cycles': config['cycles'],
+            'duration': config['duration'],
+            'soft_threshold': config['threshold'],
+            'fresh_threshold': config['threshold']
+        })
+        thread = server.test_manager_thread
+        started = server.store.snapshot()['test_start_time']
+        wall_started = time.perf_counter()
+
+        sample_count = 0
+        for offset, rows in session['batches']:
+            if fast:
+                clock.advance(started + offset, thread)
+            else:
+                clock.sleep(max(0.0, started + offset - clock.time()))
+            client.post('/api/post', json=to_packets(rows))
+            sample_count += len(rows)
+        ingest_seconds = time.perf_counter() - wall_started
+
+        # Let the remaining phases run out and the results be processed
+        while fast and thread.is_alive():
+            clock.advance(clock.time() + SteppedClock.TICK, thread)
+        thread.join()
+        wall_seconds = time.perf_counter() - wall_started
+    finally:
+        server.clock = time
+
+    status = server.store.snapshot()
+    label = status['labels'][-1] if status['labels'] else None
+    test_seconds = 2 * config['cycles'] * config['duration']
+    return {
+        'source': session['source'],
+        'batches': len(session['batches']),
+        'samples': sample_count,
+        'test_seconds': test_seconds,
+        'wall_seconds': wall_seconds,
+        'speedup': test_seconds / wall_seconds if wall_seconds else float("inf"),
+        'ingest_seconds': ingest_seconds,
+        'samples_per_second': sample_count / ingest_seconds if ingest_seconds else float("inf"),
+        'label': label,
+        'expected': session['expected'],
+        'match': session['expected'] is None or label == session['expected']
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded sessions through the ingestion path.")
+    parser.add_argument("sources", nargs="+", help="archived run directories or exported all_data.csv files")
+    pace = parser.add_mutually_exclusive_group()
+    pace.add_argument("--speed", type=float, default=1.0, help="replay N times faster than recorded (default 1)")
+    pace.add_argument("--fast", action="store_true", help="replay as fast as possible with a stepped clock")
+    parser.add_argument("--classification-type", help="override the recorded classification type")
+    parser.add_argument("--cycles", type=int, help="number of cycles (required for CSV sessions)")
+    parser.add_argument("--duration", type=int, help="seconds per phase (required for CSV sessions)")
+    parser.add_argument("--threshold", type=int, help="classification threshold")
+    parser.add_argument("--expect", help="label the replay must produce")
+    parser.add_argument("--batch-ms", type=float, default=100, help="batch window for CSV sessions (default 100)")
+    parser.add_argument("--workdir", help="directory for replay output (default: a new temporary directory)")
+    args = parser.parse_args(argv)
+
+    sessions = [load_session(source, args.batch_ms) for source in args.sources]
+    for session in sessions:
+        if args.classification_type:
+            session['classification_type'] = args.classification_type
+        config = session['config']
+        for key, default in (('cycles', args.cycles), ('duration', args.duration), ('threshold', args.threshold)):
+            if default is not None:
+                config[key] = default
+        config.setdefault('threshold', 350 if session['classification_type'] == 'soft_hard' else 750)
+        if 'cycles' not in config or 'duration' not in config:
+            parser.error(f"{session['source']}: --cycles and --duration are required for CSV sessions")
+        if args.expect:
+            session['expected'] = args.expect
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="replay-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    runs.RUNS_DIR = os.path.join(workdir, "runs")
+    print(f"Replay output goes to {workdir}")
+
+    failures = 0
+    for session in sessions:
+        report = replay(session, speed=args.speed, fast=args.fast)
+        failures += not report['match']
+        print(f"{'OK  ' if report['match'] else 'FAIL'} {report['source']}: {report['label']!r} "
+              f"(expected {report['expected']!r}), {report['samples']} samples in {report['batches']} batches, "
+              f"{report['wall_seconds']:.2f}s for a {report['test_seconds']}s test "
+              f"({report['speedup']:.1f}x, ingested at {report['samples_per_second']:.0f} samples/s)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
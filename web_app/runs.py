@@ -0,0 +1,109 @@
+"""Archive of finished tests, one directory per run under RUNS_DIR.
+
+    <run_id>/meta.json    configuration, result and timing of the test
+    <run_id>/samples.npy  (n, 11) float64: Time, TX, RX1..RX7, phase code, cycle
+    <run_id>/batches.npy  (m, 2) float64: arrival time after test start (s), samples in batch
+    <run_id>/pyramid/     min/max/mean per RX channel at several resolutions, one .npy per level (see pyramid.py)
+
+Samples are written chunk by chunk into a memory-mapped .npy file and read back
+the same way, so archiving and loading a long run never needs it all in RAM.
+"""
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+from pyramid import Pyramid
+from state_store import SAMPLE_COLUMNS
+
+RUNS_DIR = os.environ.get("RUNS_DIR", "runs")
+RUN_COLUMNS = SAMPLE_COLUMNS + ["Phase", "Cycle"]
+PHASE_CODES = {"IDLE": 0, "UNTOUCH": 1, "TOUCH": 2}
+PHASE_NAMES = {code: name for name, code in PHASE_CODES.items()}
+_RUN_ID = re.compile(r"^[\w.-]+$")
+
+
+def run_dir(run_id):
+    if not _RUN_ID.match(run_id) or run_id.startswith("."):
+        raise ValueError(f"Invalid run id: {run_id!r}")
+    return os.path.join(RUNS_DIR, run_id)
+
+
+def save_run(store, status, stage_timings=None):
+    """Archive the store's samples and batch log together with the final status and stage timers."""
+    path = run_dir(status['run_id'])
+    tmp_path = os.path.join(RUNS_DIR, f".{status['run_id']}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    count = store.sample_count()
+    samples = np.lib.format.open_memmap(os.path.join(tmp_path, "samples.npy"), mode="w+",
+                                        dtype=np.float64, shape=(count, len(RUN_COLUMNS)))
+    batches = []
+    offset = 0
+    for arrived, phase, cycle, rows in store.iter_batches():
+        end = offset + len(rows)
+        if end > count: # Batches that arrived after counting are left out
+            break
+        samples[offset:end, :len(SAMPLE_COLUMNS)] = rows
+        samples[offset:end, len(SAMPLE_COLUMNS)] = PHASE_CODES.get(phase, 0)
+        samples[offset:end, len(SAMPLE_COLUMNS) + 1] = cycle
+        batches.append((arrived - status['test_start_time'], len(rows)))
+        offset = end
+    samples.flush()
+    del samples
+    np.save(os.path.join(tmp_path, "batches.npy"), np.array(batches, dtype=np.float64).reshape(-1, 2))
+    store.save_pyramid(os.path.join(tmp_path, "pyramid"))
+
+    meta = {
+        'run_id': status['run_id'],
+        'classification_type': status['classification_type'],
+        'config': status['current_test_config'],
+        'label': status['labels'][-1] if status['labels'] else None,
+        'average_peak_value': status['average_peak_value'],
+        'touch_max_array': status['touch_max_array'],
+        'peak_summary': status['peak_summary'],
+        'test_start_time': status['test_start_time'],
+        'test_end_time': status['test_end_time'],
+        'sample_count': offset,
+        'batch_count': len(batches),
+        'stage_timings': stage_timings or {} # Wall/CPU seconds per stage, see profiling.StageTimer
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_meta(run_id):
+    return open_run(run_dir(run_id))[0]
+
+
+def load_samples(run_id):
+    """Memory-mapped (n, 11) sample array of an archived run."""
+    return open_run(run_dir(run_id))[1]
+
+
+def load_pyramid(run_id):
+    """Saved pyramid of an archived run; queries memory-map only the level they read."""
+    return Pyramid.load(os.path.join(run_dir(run_id), "pyramid"))
+
+
+def open_run(path):
+    """Return (meta, samples, batches) of the run archived in directory `path`."""
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    samples = np.load(os.path.join(path, "samples.npy"), mmap_mode="r")
+    batches = np.load(os.path.join(path, "batches.npy"))
+    return meta, samples, batches
+
+
+def list_runs():
+    if not os.path.isdir(RUNS_DIR):
+        return []
+    return sorted(name for name in os.listdir(RUNS_DIR)
+                  if not name.startswith(".") and os.path.exists(os.path.join(RUNS_DIR, name, "meta.json")))
@@ -0,0 +1,80 @@
+"""Robust aggregation of per-cycle touch peaks.
+
+Each touch phase yields one peak (the highest RX value of that cycle). Cycles
+whose peak lies more than MAD_OUTLIER_Z robust standard deviations from the
+median are treated as bad presses and left out of the mean, and the confidence
+says how clearly the remaining cycles sit on one side of the threshold. The
+spread never goes below one sensor count, so identical peaks do not turn every
+other cycle into an outlier or every decision into a certainty.
+Everything is computed over all cycles at once with NumPy.
+"""
+import math
+
+import numpy as np
+
+MAD_OUTLIER_Z = 3.5 # Modified z-score above which a cycle is an outlier
+TRIM_FRACTION = 0.2 # Share of cycles cut from each end for the trimmed mean
+MAD_TO_SIGMA = 1.4826 # MAD of a normal distribution times this is its standard deviation
+MEAN_AD_TO_SIGMA = 1.2533 # Same for the mean absolute deviation (sqrt(pi / 2))
+SENSOR_RESOLUTION = 1.0 # One ADC count, the smallest spread peaks can be told apart by
+
+
+def cycle_peaks(stats):
+    """Peak of each cycle from store.cycle_stats(): (cycles, peaks) arrays."""
+    return stats['cycle'], stats['max'].max(axis=1)
+
+
+def trimmed_mean(values, fraction=TRIM_FRACTION):
+    values = np.sort(values)
+    cut = int(len(values) * fraction)
+    return float(values[cut:len(values) - cut].mean())
+
+
+def summarize_peaks(cycles, peaks):
+    """Median, trimmed mean, MAD, inlier max and outlier flags of per-cycle peaks.
+
+    When the MAD is zero (most cycles equal) sigma falls back to the mean
+    absolute deviation, and it is never below SENSOR_RESOLUTION. 'mean' and
+    'max' are the mean and highest peak of the inlier cycles. Raises ValueError
+    for non-finite peaks.
+    """
+    peaks = np.asarray(peaks, dtype=np.float64)
+    if not np.isfinite(peaks).all():
+        raise ValueError(f"Cycle peaks must be finite, got {peaks.tolist()}")
+    median = np.median(peaks)
+    deviation = np.abs(peaks - median)
+    sigma = MAD_TO_SIGMA * np.median(deviation)
+    if sigma == 0:
+        sigma = MEAN_AD_TO_SIGMA * deviation.mean()
+    sigma = max(sigma, SENSOR_RESOLUTION)
+    outliers = deviation / sigma > MAD_OUTLIER_Z
+    inliers = peaks[~outliers]
+    return {
+        'cycles': [int(c) for c in cycles],
+        'peaks': peaks.tolist(),
+        'outliers': outliers.tolist(),
+        'median': float(median),
+        'trimmed_mean': trimmed_mean(peaks),
+        'mean': float(inliers.mean()),
+        'max': float(inliers.max()),
+        'sigma': float(sigma)
+    }
+
+
+def confidence(summary, value, threshold):
+    """0..1 confidence that `value` is on the correct side of `threshold`.
+
+    The share of inlier cycles that agree with the decision, times how many
+    standard errors the decision value is from the threshold (as erf(z/sqrt 2),
+    so 1 standard error gives 0.68 and 3 give 0.997). None when there is
+    nothing to estimate it from: fewer than two inlier cycles or a non-finite
+    value.
+    """
+    peaks = np.asarray(summary['peaks'])[~np.asarray(summary['outliers'])]
+    if len(peaks) < 2 or not math.isfinite(value):
+        return None
+    above = value > threshold
+    agreement = float(np.mean((peaks > threshold) == above))
+    standard_error = summary['sigma'] / math.sqrt(len(peaks)) # sigma >= SENSOR_RESOLUTION
+    margin = math.erf(abs(value - threshold) / standard_error / math.sqrt(2))
+    return round(agreement * margin, 3)
@@ -0,0 +1,136 @@
+"""Production entry point: gunicorn with gthread workers, or a built-in threaded server.
+
+    python serve.py                          # gunicorn if available, else the built-in server
+    SERVER=builtin python serve.py           # Werkzeug, threaded (also used where gunicorn is missing)
+    gunicorn -c gunicorn.conf.py app:app     # same settings when gunicorn is launched directly
+
+Everything is read from the environment (see load_settings). gunicorn keeps
+connections alive between the Arduino's posts (KEEPALIVE); neither server runs
+the reloader or debugger. On SIGTERM/SIGINT a test running in the process is stopped and
+finalized (CSV, plot, archive) like /stop does before the process exits.
+"""
+import os
+import signal
+import sys
+import threading
+
+
+def load_settings(environ=os.environ):
+    shared_store = bool(environ.get("DIGITAL_TOUCH_STORE"))
+    settings = {
+        'server': environ.get("SERVER", "auto"), # auto, gunicorn or builtin
+        'host': environ.get("HOST", "0.0.0.0"), # All interfaces, so the Arduino can reach the server
+        'port': int(environ.get("PORT", "5000")),
+        # Several workers need the shared store; the in-memory one lives in a single process
+        'workers': int(environ.get("WORKERS", str(min(2 * (os.cpu_count() or 1) + 1, 8) if shared_store else 1))),
+        'threads': int(environ.get("THREADS", "16")), # Per worker; each open long-poll holds one
+        'keepalive': int(environ.get("KEEPALIVE", "75")), # Seconds an idle connection stays open between posts
+        'timeout': int(environ.get("TIMEOUT", "60")), # Seconds before a stuck worker is restarted
+        'graceful_timeout': int(environ.get("GRACEFUL_TIMEOUT", "30")), # Seconds to finish requests and finalize on shutdown
+        'ingest_tcp_port': int(environ.get("INGEST_TCP_PORT", "0")) # Streamed TX frames (see ingest_server.py), 0 = off
+    }
+    if settings['workers'] > 1 and not shared_store:
+        print(f"WORKERS={settings['workers']} needs DIGITAL_TOUCH_STORE; using 1 worker.")
+        settings['workers'] = 1
+    return settings
+
+
+def start_ingest(app_module, settings):
+    if settings['ingest_tcp_port']:
+        import ingest_server
+        ingest_server.start_in_thread(app_module.ingest_packets, settings['host'], settings['ingest_tcp_port'])
+
+
+def gunicorn_options(settings):
+    """gunicorn configuration for settings, including the worker hooks."""
+
+    def post_worker_init(worker):
+        app_module = sys.modules["app"]
+        start_ingest(app_module, settings)
+
+        # Workers get no hook on SIGTERM and worker_exit only runs after graceful_timeout
+        # when connections linger, so stop a running test as soon as the signal arrives
+        handle_exit = worker.handle_exit
+
+        def handle_term(signum, frame):
+            handle_exit(signum, frame)
+            threading.Thread(target=app_module.shutdown, name="shutdown").start()
+
+        signal.signal(signal.SIGTERM, handle_term)
+
+    def worker_exit(server, worker):
+        app_module = sys.modules.get("app")
+        if app_module is not None:
+            app_module.shutdown()
+
+    return {
+        'bind': f"{settings['host']}:{settings['port']}",
+        'workers': settings['workers'],
+        'worker_class': "gthread",
+        'threads': settings['threads'],
+        'keepalive': settings['keepalive'],
+        'timeout': settings['timeout'],
+        'graceful_timeout': settings['graceful_timeout'],
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit
+    }
+
+
+def run_gunicorn(settings):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options(settings).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+    Application().run()
+
+
+def run_builtin(settings):
+    """Threaded Werkzeug server in this process (HTTP/1.1, no reloader or debugger).
+
+    Werkzeug drains the socket after every response and so closes each
+    connection; devices that need persistent connections should use gunicorn
+    or stream frames to ingest_server.py.
+    """
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    server = make_server(settings['host'], settings['port'], app_module.app, threaded=True)
+    # shutdown() waits for serve_forever() to return, so it cannot run in the signal handler itself
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    start_ingest(app_module, settings)
+    print(f"Serving on http://{settings['host']}:{settings['port']}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        app_module.shutdown()
+
+
+def main():
+    settings = load_settings()
+    server = settings['server']
+    if server == "auto":
+        try:
+            import gunicorn # Not available on Windows
+            server = "gunicorn"
+        except ImportError:
+            server = "builtin"
+    if server == "gunicorn":
+        run_gunicorn(settings)
+    elif server == "builtin":
+        run_builtin(settings)
+    else:
+        sys.exit(f"Unknown SERVER '{server}'. Use auto, gunicorn or builtin.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,425 @@
+"""Test state and sample buffers shared by every request handler.
+
+A single worker keeps everything in process (MemoryStore). Setting the
+DIGITAL_TOUCH_STORE environment variable to a file path switches to SqliteStore,
+so several gunicorn workers can ingest into and report on the same test. Put the
+file on a tmpfs such as /dev/shm to keep it in shared memory:
+
+    DIGITAL_TOUCH_STORE=/dev/shm/digital_touch.sqlite gunicorn -w 4 app:app
+
+For very long runs, SAMPLE_MEMORY_LIMIT_MB caps the samples and history
+pyramid MemoryStore keeps in RAM; older batches spill to .npy segments in
+SPILL_DIR and are read back through memory maps. The pyramid is never spilled:
+its level windows (see pyramid.py) are sized to a quarter of the limit, and it
+counts against it. (SqliteStore is bounded by where its file lives, so keep it on
+disk rather than /dev/shm for such runs.) Per-cycle statistics used for
+classification are kept in memory either way, a few hundred bytes per cycle.
+"""
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from pyramid import Pyramid, window_for
+
+SAMPLE_COLUMNS = ["Time", "TX", "RX1", "RX2", "RX3", "RX4", "RX5", "RX6", "RX7"]
+# Buffer name -> phase its samples were collected in (None means every sample)
+SAMPLE_KINDS = {"all_data": None, "untouch_data": "UNTOUCH", "touch_data": "TOUCH"}
+
+
+def _cycle_stats(cycles, counts, maxima, minima, sums):
+    """Per-cycle RX statistics as arrays ordered by cycle (see cycle_stats)."""
+    channels = len(SAMPLE_COLUMNS) - 2
+    return {
+        'cycle': np.asarray(cycles, dtype=np.int64),
+        'count': np.asarray(counts, dtype=np.int64),
+        'max': np.asarray(maxima, dtype=np.float64).reshape(-1, channels),
+        'min': np.asarray(minima, dtype=np.float64).reshape(-1, channels),
+        'sum': np.asarray(sums, dtype=np.float64).reshape(-1, channels)
+    }
+
+
+class MemoryStore:
+    """Keeps the test status and samples in this process (single worker)."""
+
+    def __init__(self, status, memory_limit=0, spill_dir=None):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
+        self._status = json.dumps(status)
+        self._chunks = [] # (arrived, phase, cycle, rows) per accepted batch
+        self._stats = {} # (phase, cycle) -> [count, max, min, sum] of the RX channels
+        self.memory_limit = memory_limit # Bytes of samples and pyramid kept in RAM; 0 means no limit
+        self.spill_dir = spill_dir
+        self._resident_bytes = 0
+        self._spilled = 0 # self._chunks[:self._spilled] live in segment files
+        self._segments = []
+        self._spilling = False # A segment is being written outside the lock
+        self._spill_count = 0 # Numbers segment files, never reset
+        self._generation = 0 # Bumped by reset, so a spill that raced it is discarded
+        self._pyramid = self._new_pyramid()
+
+    def _new_pyramid(self):
+        # Under a memory limit the pyramid gets at most a quarter of it, so
+        # spilling samples can always get back under the limit
+        return Pyramid(window=window_for(self.memory_limit // 4)) if self.memory_limit else Pyramid()
+
+    def snapshot(self):
+        """Return a copy of the status document, including its version."""
+        with self._lock:
+            status = json.loads(self._status)
+            status['version'] = self._version
+        return status
+
+    def update(self, **fields):
+        """Merge fields into the status document and bump its version."""
+        return self._modify(lambda status: status.update(fields))
+
+    def append_label(self, label, **fields):
+        """Append label to the status labels (and merge fields) in one atomic update."""
+        return self._modify(lambda status: status.update(fields, labels=status['labels'] + [label]))
+
+    def _modify(self, change):
+        with self._lock:
+            status = json.loads(self._status)
+            change(status)
+            self._status = json.dumps(status)
+            self._version += 1
+            status['version'] = self._version
+            self._changed.notify_all()
+        return status
+
+    def reset(self, status):
+        """Replace the status document and drop every sample (new test)."""
+        with self._lock:
+            self._status = json.dumps(status)
+            self._chunks = []
+            self._stats = {}
+            self._pyramid = self._new_pyramid()
+            self._resident_bytes = 0
+            self._spilled = 0
+            segments, self._segments = self._segments, []
+            self._generation += 1
+            self._version += 1
+            self._changed.notify_all()
+        for path in segments:
+            os.remove(path)
+
+    def wait_for_change(self, version, timeout):
+        """Block until the status version differs from `version` (or timeout), then snapshot.
+
+        A client holding a newer version than ours (from before a restart) gets
+        the current status straight away.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+        return self.snapshot()
+
+    def append_batch(self, rows, phase, cycle, arrived):
+        """Store an (n, 9) array of samples received at `arrived` during phase/cycle."""
+        rx = rows[:, 2:]
+        batch_max, batch_min, batch_sum = rx.max(axis=0), rx.min(axis=0), rx.sum(axis=0, dtype=np.float64)
+        with self._lock:
+            self._chunks.append((arrived, phase, cycle, rows))
+            self._resident_bytes += rows.nbytes
+            stats = self._stats.get((phase, cycle))
+            if stats is None:
+                self._stats[(phase, cycle)] = [len(rows), batch_max.astype(np.float64),
+                                               batch_min.astype(np.float64), batch_sum]
+            else:
+                stats[0] += len(rows)
+                np.maximum(stats[1], batch_max, out=stats[1])
+                np.minimum(stats[2], batch_min, out=stats[2])
+                stats[3] += batch_sum
+            self._pyramid.add(rows)
+            spill = self._plan_spill()
+        if spill:
+            self._spill(*spill)
+
+    def _plan_spill(self):
+        # Called with the lock held: pick the oldest resident batches to spill
+        # until half the limit is free, and claim the (single) spill slot
+        if not self.memory_limit or self._spilling:
+            return None
+        resident = self._resident_bytes + self._pyramid.nbytes
+        start = end = self._spilled
+        freed = 0
+        while end < len(self._chunks) and resident - freed > self.memory_limit // 2:
+            freed += self._chunks[end][3].nbytes
+            end += 1
+        if resident <= self.memory_limit or end == start:
+            return None
+        self._spilling = True
+        self._spill_count += 1
+        return self._generation, start, end, [chunk[3] for chunk in self._chunks[start:end]], self._spill_count
+
+    def _spill(self, generation, start, end, parts, number):
+        # Write the segment without the lock, so status reads and other batches
+        # carry on, then swap the batches for read-only memory-mapped views of it
+        freed = sum(part.nbytes for part in parts)
+        try:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="digital-touch-spill-")
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, f"segment-{os.getpid()}-{id(self):x}-{number:05d}.npy")
+            np.save(path, np.concatenate(parts))
+            segment = np.load(path, mmap_mode="r")
+        except OSError as e:
+            print(f"Could not spill samples, keeping them in memory: {e}")
+            with self._lock:
+                self._spilling = False
+            return
+        with self._lock:
+            self._spilling = False
+            current = generation == self._generation
+            if current:
+                offset = 0
+                for i in range(start, end):
+                    arrived, phase, cycle, rows = self._chunks[i]
+                    self._chunks[i] = (arrived, phase, cycle, segment[offset:offset + len(rows)])
+                    offset += len(rows)
+                self._segments.append(path)
+                self._spilled = end
+                self._resident_bytes -= freed
+        if not current: # A new test started while writing
+            os.remove(path)
+            return
+        print(f"Spilled {end - start} batches ({freed / 1e6:.1f} MB) to {path}")
+
+    def memory_usage(self):
+        """Bytes of samples held in RAM and in spill segments, and of the pyramid (always in RAM)."""
+        with self._lock:
+            spilled = sum(chunk[3].nbytes for chunk in self._chunks[:self._spilled])
+            return {'resident_bytes': self._resident_bytes, 'spilled_bytes': spilled,
+                    'pyramid_bytes': self._pyramid.nbytes, 'memory_limit_bytes': self.memory_limit,
+                    'segments': len(self._segments)}
+
+    def history(self, start_ms=0, end_ms=None, max_points=1000):
+        """Pyramid summary of [start_ms, end_ms) of the test, see Pyramid.query."""
+        with self._lock:
+            return self._pyramid.query(start_ms, end_ms, max_points)
+
+    def save_pyramid(self, path):
+        with self._lock:
+            pyramid = copy.deepcopy(self._pyramid)
+        pyramid.save(path) # Written outside the lock, like spill segments
+
+    def cycle_stats(self, phase):
+        """Count, max, min and sum of each RX channel per cycle of `phase`.
+
+        Returns arrays ordered by cycle: 'cycle' (k,), 'count' (k,) and
+        'max'/'min'/'sum' (k, 7). Kept up to date on every batch, so reading
+        them never touches the (possibly spilled) samples.
+        """
+        with self._lock:
+            keys = sorted(key for key in self._stats if key[0] == phase)
+            entries = [self._stats[key] for key in keys]
+            return _cycle_stats([key[1] for key in keys], [e[0] for e in entries], [e[1] for e in entries],
+                                [e[2] for e in entries], [e[3] for e in entries])
+
+    def _parts(self, kind):
+        phase = SAMPLE_KINDS[kind]
+        with self._lock:
+            return [rows for _, chunk_phase, _, rows in self._chunks if phase is None or chunk_phase == phase]
+
+    def sample_count(self, kind="all_data"):
+        return sum(len(rows) for rows in self._parts(kind))
+
+    def iter_chunks(self, kind="all_data", max_rows=65536):
+        """Yield a buffer as consecutive arrays of roughly max_rows samples."""
+        pending, count = [], 0
+        for rows in self._parts(kind):
+            pending.append(rows)
+            count += len(rows)
+            if count >= max_rows:
+                yield np.concatenate(pending)
+                pending, count = [], 0
+        if pending:
+            yield np.concatenate(pending)
+
+    def iter_batches(self):
+        """Yield (arrived, phase, cycle, rows) for every batch in arrival order."""
+        with self._lock:
+            chunks = list(self._chunks)
+        yield from chunks
+
+
+class SqliteStore:
+    """Keeps the test status and samples in a SQLite file shared by all workers."""
+
+    POLL_INTERVAL = 0.05 # Seconds between version checks while long-polling
+
+    def __init__(self, path, status):
+        self.path = path
+        self._local = threading.local()
+        # Each worker keeps its own pyramid and catches up on new samples when asked
+        self._pyramid_lock = threading.Lock()
+        self._pyramid = Pyramid()
+        self._pyramid_generation = None
+        self._pyramid_seq = 0
+        db = self._db()
+        db.execute("CREATE TABLE IF NOT EXISTS status (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER, "
+                   "generation INTEGER, doc TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY, arrived REAL, phase TEXT, cycle INTEGER)")
+        db.execute("CREATE TABLE IF NOT EXISTS samples (seq INTEGER PRIMARY KEY, batch INTEGER, phase TEXT, "
+                   "time, tx, rx1, rx2, rx3, rx4, rx5, rx6, rx7)")
+        db.execute("CREATE INDEX IF NOT EXISTS samples_by_batch ON samples (batch)")
+        # A worker joining a running server must not wipe the test in progress
+        db.execute("INSERT OR IGNORE INTO status (id, version, generation, doc) VALUES (1, 0, 0, ?)", (json.dumps(status),))
+
+    def _db(self):
+        # Connections cannot cross a fork, so each worker process (and thread) opens its own
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def snapshot(self):
+        version, doc = self._db().execute("SELECT version, doc FROM status WHERE id = 1").fetchone()
+        status = json.loads(doc)
+        status['version'] = version
+        return status
+
+    def update(self, **fields):
+        return self._modify(lambda status: status.update(fields))
+
+    def append_label(self, label, **fields):
+        return self._modify(lambda status: status.update(fields, labels=status['labels'] + [label]))
+
+    def _modify(self, change):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE") # Serialise read-modify-write across workers
+        try:
+            version, doc = db.execute("SELECT version, doc FROM status WHERE id = 1").fetchone()
+            status = json.loads(doc)
+            change(status)
+            db.execute("UPDATE status SET version = ?, doc = ? WHERE id = 1", (version + 1, json.dumps(status)))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        status['version'] = version + 1
+        return status
+
+    def reset(self, status):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM samples")
+            db.execute("DELETE FROM batches")
+            db.execute("UPDATE status SET version = version + 1, generation = generation + 1, doc = ? WHERE id = 1",
+                       (json.dumps(status),))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def wait_for_change(self, version, timeout):
+        # Workers cannot signal each other through SQLite, so poll the version row
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._db().execute("SELECT version FROM status WHERE id = 1").fetchone()[0] != version:
+                break
+            time.sleep(self.POLL_INTERVAL)
+        return self.snapshot()
+
+    def append_batch(self, rows, phase, cycle, arrived):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            batch = db.execute("INSERT INTO batches (arrived, phase, cycle) VALUES (?, ?, ?)",
+                               (arrived, phase, cycle)).lastrowid
+            db.executemany("INSERT INTO samples (batch, phase, time, tx, rx1, rx2, rx3, rx4, rx5, rx6, rx7) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [[batch, phase] + row for row in rows.tolist()])
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def _select(self, kind):
+        phase = SAMPLE_KINDS[kind]
+        query = "SELECT time, tx, rx1, rx2, rx3, rx4, rx5, rx6, rx7 FROM samples"
+        if phase is None:
+            return self._db().execute(query + " ORDER BY seq")
+        return self._db().execute(query + " WHERE phase = ? ORDER BY seq", (phase,))
+
+    def sample_count(self, kind="all_data"):
+        phase = SAMPLE_KINDS[kind]
+        if phase is None:
+            return self._db().execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+        return self._db().execute("SELECT COUNT(*) FROM samples WHERE phase = ?", (phase,)).fetchone()[0]
+
+    def iter_chunks(self, kind="all_data", max_rows=65536):
+        cursor = self._select(kind)
+        while True:
+            rows = cursor.fetchmany(max_rows)
+            if not rows:
+                break
+            yield np.array(rows)
+
+    def iter_batches(self):
+        db = self._db()
+        for batch, arrived, phase, cycle in db.execute("SELECT id, arrived, phase, cycle FROM batches ORDER BY id").fetchall():
+            rows = db.execute("SELECT time, tx, rx1, rx2, rx3, rx4, rx5, rx6, rx7 FROM samples "
+                              "WHERE batch = ? ORDER BY seq", (batch,)).fetchall()
+            yield arrived, phase, cycle, np.array(rows)
+
+    def memory_usage(self):
+        with self._pyramid_lock:
+            pyramid_bytes = self._pyramid.nbytes
+        return {'database_bytes': os.path.getsize(self.path), 'pyramid_bytes': pyramid_bytes}
+
+    def _sync_pyramid(self):
+        # Called with _pyramid_lock held; a reset (new generation) starts a new pyramid
+        db = self._db()
+        generation = db.execute("SELECT generation FROM status WHERE id = 1").fetchone()[0]
+        if generation != self._pyramid_generation:
+            self._pyramid, self._pyramid_generation, self._pyramid_seq = Pyramid(), generation, 0
+        cursor = db.execute("SELECT seq, time, tx, rx1, rx2, rx3, rx4, rx5, rx6, rx7 FROM samples "
+                            "WHERE seq > ? ORDER BY seq", (self._pyramid_seq,))
+        while True:
+            rows = cursor.fetchmany(65536)
+            if not rows:
+                break
+            rows = np.array(rows)
+            self._pyramid.add(rows[:, 1:])
+            self._pyramid_seq = int(rows[-1, 0])
+
+    def history(self, start_ms=0, end_ms=None, max_points=1000):
+        with self._pyramid_lock:
+            self._sync_pyramid()
+            return self._pyramid.query(start_ms, end_ms, max_points)
+
+    def save_pyramid(self, path):
+        with self._pyramid_lock:
+            self._sync_pyramid()
+            self._pyramid.save(path)
+
+    def cycle_stats(self, phase):
+        rx = [f"rx{i}" for i in range(1, 8)]
+        rows = self._db().execute(
+            "SELECT b.cycle, COUNT(*), " + ", ".join(f"MAX(s.{c})" for c in rx) + ", "
+            + ", ".join(f"MIN(s.{c})" for c in rx) + ", " + ", ".join(f"TOTAL(s.{c})" for c in rx)
+            + " FROM samples s JOIN batches b ON s.batch = b.id WHERE s.phase = ? GROUP BY b.cycle ORDER BY b.cycle",
+            (phase,)).fetchall()
+        return _cycle_stats([r[0] for r in rows], [r[1] for r in rows], [r[2:9] for r in rows],
+                            [r[9:16] for r in rows], [r[16:23] for r in rows])
+
+
+def open_store(status):
+    """Pick the backend from the environment; status seeds an empty store."""
+    path = os.environ.get("DIGITAL_TOUCH_STORE")
+    if path:
+        print(f"Using shared state store at {path}")
+        return SqliteStore(path, status)
+    memory_limit = int(float(os.environ.get("SAMPLE_MEMORY_LIMIT_MB", "0")) * 1024 * 1024)
+    return MemoryStore(status, memory_limit=memory_limit, spill_dir=os.environ.get("SPILL_DIR"))
@@ -0,0 +1,168 @@
+const startBtn = document.getElementById("startBtn");
+const stopBtn = document.getElementById("stopBtn");
+const statusBox = document.getElementById("status");
+const timerBox = document.getElementById("timer");
+
+// The timer counts locally from the first "Collecting" status; the server only
+// reports the total once the test has finished
+let timerStartedAt = null; // performance.now() when the timer first became visible
+let statusVersion = null; // Last /status version seen, used for long-polling
+
+// Dark mode
+const darkSwitch = document.getElementById('darkSwitch');
+if (localStorage.getItem("dark-mode") === "true") {
+  document.body.classList.add('dark');
+  darkSwitch.checked = true;
+}
+
+darkSwitch.addEventListener('change', () => {
+  document.body.classList.toggle('dark');
+  localStorage.setItem("dark-mode", darkSwitch.checked);
+});
+
+const softGroup = document.getElementById("softHardThresholdGroup");
+const freshGroup = document.getElementById("freshRottenThresholdGroup");
+document.querySelectorAll('input[name="classification_type"]').forEach(radio => {
+  radio.addEventListener("change", () => {
+    if (radio.checked && radio.value === "soft_hard") {
+      softGroup.classList.remove("hidden");
+      freshGroup.classList.add("hidden");
+    } else {
+      softGroup.classList.add("hidden");
+      freshGroup.classList.remove("hidden");
+    }
+  });
+});
+
+
+document.getElementById("testForm").onsubmit = async function(e) {
+  e.preventDefault();
+  const classificationType = document.querySelector('input[name="classification_type"]:checked').value;
+  const cycles = document.getElementById("cycles").value;
+  const duration = document.getElementById("duration").value;
+  const softThreshold = document.getElementById("softThreshold").value;
+  const freshThreshold = document.getElementById("freshThreshold").value;
+
+  // Reset UI and timer state for a new test
+  statusBox.className = 'info-box running';
+  statusBox.innerText = "Status: Starting test..."; // Initial status during the delay
+  timerBox.classList.add("hidden"); // Hide timer initially
+  timerStartedAt = null; // Reset the timer
+  document.getElementById("result").classList.add("hidden");
+  document.getElementById("average").classList.add("hidden");
+  document.getElementById("plotArea").classList.add("hidden");
+
+  // Spinner ON (start button disabled)
+  startBtn.disabled = true;
+
+  const res = await fetch('/start', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      classification_type: classificationType,
+      cycles: cycles,
+      duration: duration,
+      soft_threshold: softThreshold,
+      fresh_threshold: freshThreshold
+    })
+  });
+
+  const data = await res.json();
+  startBtn.disabled = false;
+  // Status text will be updated by updateStatus polling
+};
+
+
+stopBtn.onclick = async function() {
+  const confirmStop = confirm("Are you sure you want to stop the test?");
+  if (!confirmStop) return;
+
+  await fetch('/stop');
+  statusBox.className = 'info-box error';
+  statusBox.innerText = "Status: Test stopped by user.";
+  timerBox.classList.add("hidden"); // Hide timer on stop
+  timerBox.innerText = "Elapsed Time: 0s";
+  timerStartedAt = null; // Reset the timer
+};
+
+function tickTimer() {
+  if (timerStartedAt !== null) {
+    const displayTime = Math.floor((performance.now() - timerStartedAt) / 1000);
+    timerBox.innerText = "Elapsed Time: " + displayTime + "s";
+  }
+}
+setInterval(tickTimer, 1000);
+
+function showStatus(data) {
+  if (data.status) {
+    statusBox.innerText = "Status: " + data.status;
+  }
+
+  if (data.status.includes("Collecting") || data.status.includes("Cycle")) { // Added "Collecting" for general data collection phase
+    if (timerStartedAt === null) {
+        // This is the first time we're seeing a "Collecting" or "Cycle" status, so counting starts from 0
+        timerStartedAt = performance.now();
+        timerBox.classList.remove("hidden");
+        timerBox.innerText = "Elapsed Time: 0s"; // Display 0 at the start of measurement
+    }
+  } else if (data.finished) {
+        timerBox.classList.remove("hidden");
+        // For total time, display the test duration measured by the backend
+        timerBox.innerText = "Total Time: " + data.elapsed_time + "s";
+        timerStartedAt = null; // Reset for next test cycle
+  } else { // Idle, starting, or stopped before a cycle began
+        timerBox.classList.add("hidden");
+        timerBox.innerText = "Elapsed Time: 0s"; // Reset visual for next run
+        timerStartedAt = null;
+  }
+
+  if (data.finished) {
+    statusBox.className = 'info-box success';
+    const currentType = document.querySelector('input[name="classification_type"]:checked').value;
+
+    if (currentType === "soft_hard" && data.average !== null && data.average !== undefined) {
+      let averageText = "Average of Touch Peaks: " + data.average.toFixed(2);
+      if (data.cycle_peaks) {
+        // Peaks per cycle, outliers (left out of the average) marked with *
+        averageText += " (median " + data.median_peak.toFixed(2) + "; per cycle: " +
+          data.cycle_peaks.map(c => c.peak.toFixed(0) + (c.outlier ? "*" : "")).join(", ") + ")";
+      }
+      document.getElementById("average").innerText = averageText;
+      document.getElementById("average").classList.remove("hidden");
+    } else {
+      document.getElementById("average").classList.add("hidden");
+    }
+
+    let resultText = "Classification: " + data.result;
+    if (data.confidence !== null && data.confidence !== undefined) {
+      resultText += " (confidence " + Math.round(data.confidence * 100) + "%)";
+    }
+    document.getElementById("result").innerText = resultText;
+    document.getElementById("result").classList.remove("hidden");
+
+    document.getElementById("plotImg").src = "/plot?v=" + data.version;
+    document.getElementById("plotArea").classList.remove("hidden");
+  }
+}
+
+async function updateStatus() {
+  // Long-poll: the server answers as soon as the status version changes
+  // (or after its timeout with the unchanged status)
+  let delay = 0;
+  try {
+    const url = statusVersion === null ? '/status' : '/status?wait_for_version=' + statusVersion;
+    const res = await fetch(url);
+    const data = await res.json();
+    if (data.version !== statusVersion) {
+      statusVersion = data.version;
+      showStatus(data);
+    }
+  } catch (error) {
+    console.error("Error updating status:", error);
+    delay = 1000; // Back off while the server is unreachable
+  }
+
+  setTimeout(updateStatus, delay);
+}
+
+updateStatus();